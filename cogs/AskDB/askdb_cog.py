@@ -1,10 +1,16 @@
+import asyncio
+import os
 import sys
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional
 
 import discord
 from discord.ext import commands
 
 from utils.ai import ChatQuery
+from utils.breaker import CircuitOpenError
+from utils.cache import AnswerCache
+from utils.history import ConversationHistory
+from utils.singleflight import SingleFlight
 from utils.mongo_db import MongoDBHandler
 from discord_bot.logger import log_debug, log_error, log_info
 
@@ -34,6 +40,51 @@ class AskDB(commands.Cog):
           bot (Bot): The bot instance.
         """
         self.bot = bot
+        self.history = ConversationHistory(
+            max_turns=bot.config.get("askdb_history_turns", 5),
+            max_tokens=bot.config.get("askdb_history_tokens", 1000),
+            ttl=bot.config.get("askdb_history_ttl", 1800),
+            max_conversations=bot.config.get("askdb_history_conversations", 1000),
+            handler=handler if bot.config.get("askdb_history_spill", False) else None,
+            model=bot.openai_model,
+        )
+        self.cache = AnswerCache(
+            threshold=bot.config.get("askdb_cache_threshold", 0.95),
+            ttl=bot.config.get("askdb_cache_ttl", 86400),
+            max_entries=bot.config.get("askdb_cache_entries", 256),
+        )
+        self.inflight = SingleFlight("askdb")
+
+    def forget(self, db_id: str, user_id: Optional[str] = None) -> None:
+        """
+        Drops the cached answers and conversation histories of a DB.
+        Args:
+          db_id (str): The ID of the DB whose documents changed or were deleted.
+          user_id (str, optional): Only drop this user's histories, keeping the answers cached for the
+            other users of a shared DB.
+        """
+        if user_id is None:
+            self.cache.invalidate(db_id)
+        self.history.clear(db_id, user_id)
+
+    def resolve_db_ids(self, user_id: str, db_id: str) -> list:
+        """
+        Resolves the db_id argument of askdb into a list of DB IDs.
+        Args:
+          user_id (str): The ID of the user asking.
+          db_id (str): A DB ID, several comma separated DB IDs, or "all" for every DB of the user.
+        Returns:
+          list: The unique DB IDs, sorted.
+        Examples:
+          >>> resolve_db_ids('123', '456, 789')
+          ['456', '789']
+        """
+        if db_id.strip().lower() == "all":
+            user_dbs = handler.list_db(user_id)
+            if isinstance(user_dbs, str):
+                return []
+            return sorted({db["db_id"] for db in user_dbs})
+        return sorted({part.strip() for part in db_id.split(",") if part.strip()})
 
     @commands.hybrid_command()
     async def askdb(
@@ -47,7 +98,7 @@ class AskDB(commands.Cog):
         Args:
         ctx (commands.Context): The context of the command.
         query (str): The query to search for.
-        db_id (str): The DB ID of the documents to search.
+        db_id (str): The DB ID of the documents to search, several comma separated DB IDs, or "all" for all of your DBs.
         Returns:
         discord.Embed: An embed containing the query results.
         Examples:
@@ -59,50 +110,136 @@ class AskDB(commands.Cog):
             await ctx.send(embed=discord.Embed(title="Error", color=embed_color_failure, description="Please use this command in the 'AI' text-chat category."), ephemeral=True)
             return
 
-        if not handler.check_exists(db_id=db_id):
+        user_id = str(ctx.author.id)
+        try:
+            db_ids = self.resolve_db_ids(user_id, db_id)
+            exists = all(handler.check_exists(db_id=db) for db in db_ids)
+        except CircuitOpenError as e:
+            await ctx.send(embed=unavailable_embed(e), ephemeral=True)
+            return
+
+        if not db_ids:
+            await ctx.send(embed=discord.Embed(title="Error", color=embed_color_failure, description="You have no DBs to ask."), ephemeral=True)
+            return
+
+        if not exists:
             await ctx.send(embed=discord.Embed(title="Error", color=embed_color_failure, description="The DB ID you provided does not exist."), ephemeral=True)
             return
         await ctx.defer(ephemeral=True)
-        chat_history = []
+        history_key = ",".join(db_ids)
+        chat_history = self.history.get(user_id, history_key)
         log_debug(self.bot, f"Query: {query}")
+        message = None
         try:
-            chat_query = ChatQuery(self.bot, namespace=db_id)
-            q = chat_query.query()
-            result = q({"question": query, "chat_history": chat_history})
-            source_documents = result["source_documents"]
-            parsed_documents = []
-            for doc in source_documents:
-                parsed_doc = {
-                    "page_content": doc.page_content,
-                    "metadata": {
-                        "author": doc.metadata.get("author", ""),
-                        "creationDate": doc.metadata.get("creationDate", ""),
-                        "creator": doc.metadata.get("creator", ""),
-                        "file_path": doc.metadata.get("file_path", ""),
-                        "format": doc.metadata.get("format", ""),
-                        "keywords": doc.metadata.get("keywords", ""),
-                        "modDate": doc.metadata.get("modDate", ""),
-                        "page_number": doc.metadata.get("page_number", 0),
-                        "producer": doc.metadata.get("producer", ""),
-                        "source": doc.metadata.get("source", ""),
-                        "subject": doc.metadata.get("subject", ""),
-                        "title": doc.metadata.get("title", ""),
-                        "total_pages": doc.metadata.get("total_pages", 0),
-                        "trapped": doc.metadata.get("trapped", ""),
-                    },
-                }
-                parsed_documents.append(parsed_doc)
-            embed = discord.Embed(
-                title="AskDB Results:",
-                description=f'{result["answer"]}\n\n',
-                color=embed_color_chat,
-            )
-
-            embed.add_field(name="Prompt:", value=f"**{query}**", inline=False)
+            message = await ctx.send(embed=self.answer_embed(query, "*Thinking...*"), ephemeral=True)
+            tokens = []
+            refresher = asyncio.create_task(self.refresh_answer(message, query, tokens))
+            try:
+                chat_query = ChatQuery(
+                    self.bot,
+                    namespace=db_ids,
+                    cache=self.cache,
+                    group=str(ctx.guild.id) if ctx.guild else "",
+                    channel=str(ctx.channel.id),
+                )
+                key = (history_key, " ".join(query.lower().split()), tuple(chat_history))
+                result = await self.inflight.do(
+                    key, lambda: chat_query.ask(query, chat_history, on_token=tokens.append)
+                )
+            finally:
+                refresher.cancel()
+                await asyncio.gather(refresher, return_exceptions=True)
+            self.history.append(user_id, history_key, query, result["answer"])
+
+            embed = self.answer_embed(query, result["answer"])
+            sources = []
+            for doc in result["source_documents"]:
+                source = os.path.basename(doc.metadata.get("source", ""))
+                if source and source not in sources:
+                    sources.append(source)
+            if sources:
+                embed.add_field(name="Sources:", value=truncate("\n".join(sources), 1024), inline=False)
+        except CircuitOpenError as e:
+            log_debug(self.bot, f"AskDB unavailable: {e}")
+            embed = unavailable_embed(e)
         except Exception as e:
             log_error(self.bot, f"Error querying the DB: {e}")
             embed = discord.Embed(title="Error", color=embed_color_failure, description="An error occurred while querying the DB.")
-        await ctx.send(embed=embed, ephemeral=True)
+
+        if message is not None:
+            await message.edit(embed=embed)
+        else:
+            await ctx.send(embed=embed, ephemeral=True)
+
+    def answer_embed(self, query: str, answer: str) -> discord.Embed:
+        """
+        Builds the embed showing an answer.
+        Args:
+          query (str): The query asked.
+          answer (str): The answer, complete or generated so far.
+        Returns:
+          discord.Embed: The answer embed.
+        """
+        embed = discord.Embed(
+            title="AskDB Results:",
+            description=truncate(answer, 4096),
+            color=embed_color_chat,
+        )
+        embed.add_field(name="Prompt:", value=truncate(f"**{query}**", 1024), inline=False)
+        return embed
+
+    async def refresh_answer(self, message: discord.Message, query: str, tokens: list) -> None:
+        """
+        Edits a message with the answer generated so far until cancelled.
+        Args:
+          message (discord.Message): The message to edit.
+          query (str): The query asked.
+          tokens (list): The tokens generated so far, appended to while this runs.
+        Notes:
+          Edits are throttled to one every askdb_stream_interval seconds, and skipped when nothing new was generated.
+        """
+        interval = self.bot.config.get("askdb_stream_interval", 1.0)
+        shown = 0
+        while True:
+            await asyncio.sleep(interval)
+            if len(tokens) == shown:
+                continue
+            shown = len(tokens)
+            try:
+                await message.edit(embed=self.answer_embed(query, "".join(tokens) + " ..."))
+            except discord.HTTPException as e:
+                log_debug(self.bot, f"Failed to stream askdb answer: {e}")
+
+
+def unavailable_embed(error: CircuitOpenError) -> discord.Embed:
+    """
+    Builds the embed shown while a service askdb depends on is failing.
+    Args:
+      error (CircuitOpenError): The error raised by the open circuit breaker.
+    Returns:
+      discord.Embed: The error embed.
+    """
+    return discord.Embed(
+        title="Error",
+        color=embed_color_failure,
+        description=f"AskDB is temporarily unavailable. Please try again in {max(1, round(error.retry_in))} seconds.",
+    )
+
+
+def truncate(text: str, limit: int) -> str:
+    """
+    Shortens text to fit a Discord embed limit.
+    Args:
+      text (str): The text.
+      limit (int): The maximum length.
+    Returns:
+      str: The text, cut short with an ellipsis if it was too long.
+    Examples:
+      >>> truncate("Hello world!", 8)
+      'Hello...'
+    """
+    return text if len(text) <= limit else text[: limit - 3] + "..."
+
 
 async def setup(bot: "Bot") -> None:
     """Loads the cog."""
@@ -70,6 +70,12 @@ class DeleteDBCog(commands.Cog):
         r = handler.delete_db(user_id=user_id, db_id=db_id)
         if r is True:
             log_debug(self.bot, f"Successfully deleted DB with ID: {db_id}")
+            # Recent ingests of a URL are shared, so other users may still own this db.
+            shared = handler.check_exists(db_id=db_id)
+            handler.delete_history(db_id=db_id, user_id=user_id if shared else None)
+            askdb = self.bot.get_cog("AskDB")
+            if askdb is not None:
+                askdb.forget(db_id, user_id if shared else None)
             embed = discord.Embed(title="Status", color=embed_color_success)
             embed.add_field(
                 name="Status",
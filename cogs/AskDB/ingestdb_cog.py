@@ -1,13 +1,14 @@
 import sys
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import TYPE_CHECKING
 
 import discord
 from discord.ext import commands
 
-from utils.ingest import ingest
+from utils.ingest import ingest, normalize_url
 from utils.mongo_db import MongoDBHandler
+from utils.singleflight import SingleFlight
 from discord_bot.logger import log_debug, log_error, log_info
 
 from urllib.parse import urlparse
@@ -35,6 +36,38 @@ class IngestDBCog(commands.Cog):
           bot (Bot): The Bot instance.
         """
         self.bot = bot
+        self.inflight = SingleFlight("ingestdb")
+
+    async def run_ingest(self, url: str) -> str:
+        """
+        Ingests a URL into a new namespace.
+        Args:
+          url (str): The URL to ingest.
+        Returns:
+          str: The ID of the new DB.
+        """
+        namespace = str(uuid.uuid4())
+        await ingest(self.bot, url=url, namespace=namespace)
+        askdb = self.bot.get_cog("AskDB")
+        if askdb is not None:
+            askdb.forget(namespace)
+        return namespace
+
+    def find_recent_ingest(self, url: str):
+        """
+        Finds a DB ingested from a URL recently enough to reuse.
+        Args:
+          url (str): The normalized URL.
+        Returns:
+          str: The ID of the DB, or None if there is none or reuse is disabled.
+        Notes:
+          Reuse is controlled by ingest_reuse_seconds, and is disabled when it is 0.
+        """
+        reuse_seconds = self.bot.config.get("ingest_reuse_seconds", 0)
+        if not reuse_seconds:
+            return None
+        since = datetime.now() - timedelta(seconds=reuse_seconds)
+        return handler.find_ingest(url=url, since=since)
 
     @commands.hybrid_command()
     async def ingestdb(self, ctx: commands.Context, url: str, db_name: str):
@@ -69,7 +102,6 @@ class IngestDBCog(commands.Cog):
         await ctx.defer(ephemeral=True)
         try:
             try:
-                random_uuid = str(uuid.uuid4())
                 embed = discord.Embed(
                     title="Ingesting URL",
                     type="rich",
@@ -80,7 +112,12 @@ class IngestDBCog(commands.Cog):
                 log_debug(
                     self.bot, f"Ingesting {url} as {db_name} for {ctx.author.name}"
                 )
-                await ingest(self.bot, url=url, namespace=random_uuid)
+                key = normalize_url(url)
+                random_uuid = self.find_recent_ingest(key)
+                if random_uuid is None:
+                    random_uuid = await self.inflight.do(key, lambda: self.run_ingest(url))
+                else:
+                    log_debug(self.bot, f"Reusing recent ingest of {key}: {random_uuid}")
                 current_time = datetime.now()
                 handler.handle_data(
                     user_id=str(ctx.author.id),
@@ -89,6 +126,7 @@ class IngestDBCog(commands.Cog):
                     db_id=random_uuid,
                     ingest_url=url,
                     ingested_time=current_time,
+                    normalized_url=key,
                 )
                 embed = discord.Embed(
                     title="Success",
@@ -105,6 +143,7 @@ class IngestDBCog(commands.Cog):
                 embed = discord.Embed(
                     title="Error", description=f"Error: {e}", color=embed_color_failure
                 )
+                await ctx.send(embed=embed, ephemeral=True)
             else:
                 pass
         except Exception as e:
@@ -1,18 +1,25 @@
 from __future__ import annotations
 
+import asyncio
 import time
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Optional, Tuple
 
 import discord
 from discord.ext import commands
 
-from utils.ai import ChatAgent
+from utils.ai import ChatAgentPool
+from utils.breaker import CircuitOpenError
+from utils.metrics import metrics
+from utils.mongo_db import MongoDBHandler
 from discord_bot.logger import log_debug, log_error, log_info
-from utils.tools import split_chat
+from utils.tools import ChatSplitter, LabelStripper
+from utils.workqueue import WorkQueues
 
 if TYPE_CHECKING:
     from discord_bot.bot import Bot
 
+handler = MongoDBHandler("chatbot")
+
 
 class ChatbotCog(
     commands.Cog, name="Chatbot Cog", description="LangChain + ChatGPT integration."
@@ -31,7 +38,7 @@ class ChatbotCog(
         Args:
           bot (Bot): The Bot object.
         Side Effects:
-          Sets the guild_id, chatbot_threads_id, category_id, _cd, and embed_color attributes.
+          Sets the guild_id, chatbot_threads_id, category_id, _cd, queues, debounce, pending_prompts, inflight, idle, agents, and embed_color attributes.
         Notes:
           Be sure to set the appropriate environment variables.
         Examples:
@@ -45,8 +52,35 @@ class ChatbotCog(
         self._cd = commands.CooldownMapping.from_cooldown(
             1, 3.0, commands.BucketType.member
         )
+        self.queues = WorkQueues(
+            "chat",
+            max_depth=bot.config.get("chat_queue_depth", 5),
+            max_concurrency=bot.config.get("chat_max_concurrency", 8),
+            max_pending=bot.config.get("chat_max_pending", 50),
+        )
+        self.debounce = bot.config.get("chat_debounce_seconds", 0)
+        self.pending_prompts = {}
+        self.inflight = {}
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.agents = ChatAgentPool(
+            bot,
+            max_agents=bot.config.get("chat_max_conversations", 1000),
+            ttl=bot.config.get("chat_conversation_ttl", 3600),
+            handler=handler if bot.config.get("chat_memory_persist", True) else None,
+            flush_interval=bot.config.get("chat_memory_flush_seconds", 5),
+            store_ttl=bot.config.get("chat_memory_store_ttl", 604800),
+        )
         self.embed_color = discord.Color.brand_green()
 
+    async def cog_unload(self) -> None:
+        """Saves every changed conversation before the cog is unloaded, even those still being summarized."""
+        await self.agents.flush(force=True)
+
+    async def drain(self) -> None:
+        """Waits until no responses are being generated, so the bot can shut down without cutting replies short."""
+        await self.idle.wait()
+
     @commands.Cog.listener()
     async def on_thread_create(self, thread: discord.Thread):
         """Called when a thread is created."""
@@ -72,29 +106,32 @@ class ChatbotCog(
         Listens for messages and responds with a Chat-GPT response.
         Args:
           ctx (discord.Message): The message context.
-        Side Effects:
-          Sets the channel_id attribute of the ChatbotCog instance.
         Notes:
-          There is a built in rate limiter.
+          Each channel and thread has its own conversation.
+          There is a built in rate limiter. Responses are queued per channel, and the
+          message is answered with a busy reply when the queues are full.
+          With chat_debounce_seconds set, messages a user sends in quick succession
+          are merged into one prompt.
+          Messages are ignored once the bot is shutting down.
         Examples:
           >>> on_message(ctx)
         """
-        chat_agents = {}
+        if not self.bot.running:
+            return
+
         chatbot = self.bot.user
         prompt = str(ctx.content)
         user = str(ctx.author.display_name)
 
         channel = ctx.channel
-        self.channel_id = channel.id
         mentioned = False
 
         if prompt.startswith(self.bot.config.get("prefix")):
             return
 
         if ctx.guild != self.guild_id:
-            ratelimit = self.get_ratelimit(ctx)
             supported_channel = self.category_id
-            self.channel_id = (
+            location_id = (
                 ctx.channel.category_id
                 if isinstance(ctx.channel, discord.Thread)
                 else ctx.channel.id
@@ -103,47 +140,25 @@ class ChatbotCog(
             if chatbot in ctx.mentions:
                 mentioned = True
 
-            if self.channel_id != supported_channel or mentioned:
+            if location_id != supported_channel or mentioned:
                 return
 
             if not (ctx.author.bot):
-                waiting = True
+                if self.join_pending(ctx):
+                    return
 
+                ratelimit = self.get_ratelimit(ctx)
                 if ratelimit is None or ratelimit < 0:
-                    log_debug(self.bot, "Sending message to Chat-GPT...")
-
-                    async with channel.typing():
-                        while waiting:
-                            if self.channel_id not in chat_agents:
-                                chat_agents[self.channel_id] = ChatAgent(
-                                    self.bot, self.channel_id
-                                )
-
-                            chat_agent = chat_agents[self.channel_id]
-                            messages = chat_agent.predict(prompt)
-
-                            if not messages:
-                                raise ValueError("No response received from the agent.")
-
-                            log_debug(self.bot, "Received response from OpenAI.")
-
-                            response = messages
-                            response_chunks = split_chat(response)
-
-                            if response_chunks is None:
-                                waiting = False
-                                log_debug(self.bot, "No response from Chat-GPT API.")
-                                return
-
-                            for chunk in response_chunks:
-                                if channel is not None:
-                                    await channel.send(chunk)
-                                    time.sleep(0.33)
-                            else:
-                                waiting = False
+                    agent_key = (ctx.guild.id if ctx.guild else 0, channel.id)
+                    self.track(ctx.id, agent_key)
+                    try:
+                        if self.debounce:
+                            prompt = await self.collect(ctx)
+                        await self.reply(channel, agent_key, prompt, user, ctx.guild)
+                    finally:
+                        self.untrack(ctx.id)
                 else:
                     rate_response = f"You are talking too fast, {user}"
-                    waiting = False
                     log_debug(
                         self.bot,
                         f"User {user} is talking too fast. Rate limit: {ratelimit}",
@@ -151,6 +166,233 @@ class ChatbotCog(
                     await channel.send(rate_response)
                     return
 
+    @commands.Cog.listener()
+    async def on_message_delete(self, message: discord.Message):
+        """
+        Cancels the response to a message that was deleted while it was being generated.
+        Args:
+          message (discord.Message): The deleted message.
+        Side Effects:
+          Cancels the response, giving back its rate limit budget.
+        """
+        entry = self.inflight.pop(message.id, None)
+        if entry is None:
+            return
+        entry["task"].cancel()
+        if not self.inflight:
+            self.idle.set()
+        metrics.incr("chat_cancelled")
+        log_debug(self.bot, f"Message {message.id} deleted, cancelled its response.")
+
+    @commands.Cog.listener()
+    async def on_message_edit(self, before: discord.Message, after: discord.Message):
+        """
+        Restarts the response to a message that was edited while it was being generated.
+        Args:
+          before (discord.Message): The message before the edit.
+          after (discord.Message): The message after the edit.
+        Side Effects:
+          Cancels the response to the old content and responds to the new content.
+        """
+        if before.content == after.content:
+            return
+        entry = self.inflight.pop(after.id, None)
+        if entry is None:
+            return
+        entry["task"].cancel()
+        metrics.incr("chat_restarted")
+        log_debug(self.bot, f"Message {after.id} edited, restarting its response.")
+
+        self.track(after.id, entry["agent_key"])
+        try:
+            await self.reply(
+                after.channel,
+                entry["agent_key"],
+                str(after.content),
+                str(after.author.display_name),
+                after.guild,
+            )
+        finally:
+            self.untrack(after.id)
+
+    def track(self, message_id: int, agent_key: Tuple[int, int]) -> None:
+        """
+        Records that the current task is responding to a message.
+        Args:
+          message_id (int): The ID of the message.
+          agent_key (tuple): The (guild ID, channel or thread ID) of the conversation the message belongs to.
+        """
+        self.inflight[message_id] = {"task": asyncio.current_task(), "agent_key": agent_key}
+        self.idle.clear()
+
+    def untrack(self, message_id: int) -> None:
+        """
+        Forgets the response to a message, if the current task is still the one responding.
+        Args:
+          message_id (int): The ID of the message.
+        """
+        entry = self.inflight.get(message_id)
+        if entry is not None and entry["task"] is asyncio.current_task():
+            del self.inflight[message_id]
+        if not self.inflight:
+            self.idle.set()
+
+    async def reply(
+        self,
+        channel: discord.abc.Messageable,
+        agent_key: Tuple[int, int],
+        prompt: str,
+        user: str,
+        guild: Optional[discord.Guild],
+    ) -> None:
+        """
+        Queues the response to a prompt and waits for it, or sends a busy reply when the queues are full.
+        Args:
+          channel (discord.abc.Messageable): The channel to respond in.
+          agent_key (tuple): The (guild ID, channel or thread ID) of the conversation the prompt belongs to.
+          prompt (str): The prompt to respond to.
+          user (str): The display name of the user who sent the prompt.
+          guild (discord.Guild, optional): The guild the prompt was sent in.
+        Notes:
+          Cancelling the waiting task cancels the response, whether it is queued or being generated.
+        """
+        future = self.queues.submit(
+            channel.id, lambda: self.respond(channel, agent_key, prompt, user, guild)
+        )
+        if future is None:
+            log_debug(self.bot, f"Chat queues full, shedding message from {user}.")
+            await channel.send(f"Sorry {user}, I'm busy right now. Please try again in a moment.")
+            return
+        await future
+
+    def join_pending(self, message: discord.Message) -> bool:
+        """
+        Adds a message to its author's prompt that is still being collected, if there is one.
+        Args:
+          message (discord.Message): The message.
+        Returns:
+          bool: True if the message was merged into the pending prompt.
+        """
+        pending = self.pending_prompts.get((message.channel.id, message.author.id))
+        if pending is None:
+            return False
+        pending["parts"].append(str(message.content))
+        pending["event"].set()
+        metrics.incr("chat_debounced")
+        return True
+
+    async def collect(self, message: discord.Message) -> str:
+        """
+        Waits for the author's follow up messages and merges them into one prompt.
+        Args:
+          message (discord.Message): The first message of the prompt.
+        Returns:
+          str: The messages joined by newlines.
+        Notes:
+          Collecting ends once the author has been quiet for chat_debounce_seconds,
+          or after chat_debounce_max_seconds in total.
+        Examples:
+          >>> await collect(message)
+          'how do I install it?\non windows'
+        """
+        key = (message.channel.id, message.author.id)
+        pending = {"parts": [str(message.content)], "event": asyncio.Event()}
+        self.pending_prompts[key] = pending
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.bot.config.get("chat_debounce_max_seconds", self.debounce * 4)
+
+        try:
+            while True:
+                pending["event"].clear()
+                remaining = min(self.debounce, deadline - loop.time())
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(pending["event"].wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+        finally:
+            del self.pending_prompts[key]
+
+        return "\n".join(pending["parts"])
+
+    async def respond(
+        self,
+        channel: discord.abc.Messageable,
+        agent_key: Tuple[int, int],
+        prompt: str,
+        user: str,
+        guild: Optional[discord.Guild],
+    ) -> None:
+        """
+        Sends a Chat-GPT response to a prompt, once its turn in the channel's queue comes.
+        Args:
+          channel (discord.abc.Messageable): The channel to respond in.
+          agent_key (tuple): The (guild ID, channel or thread ID) of the conversation the prompt belongs to.
+          prompt (str): The prompt to respond to.
+          user (str): The display name of the user who sent the prompt.
+          guild (discord.Guild, optional): The guild the prompt was sent in.
+        Side Effects:
+          Sends the response to the channel in chunks, each as soon as it is generated,
+          with any speaker labels removed.
+        """
+        log_debug(self.bot, "Sending message to Chat-GPT...")
+
+        async with channel.typing():
+            chat_agent = await self.agents.get(agent_key)
+            stripper = LabelStripper(self.bot, user)
+            splitter = ChatSplitter()
+            chunks = asyncio.Queue()
+
+            def stream(text: str) -> None:
+                for chunk in splitter.feed(stripper.feed(text)):
+                    chunks.put_nowait(chunk)
+
+            sender = asyncio.create_task(self.send_chunks(channel, chunks))
+            try:
+                messages = await chat_agent.apredict(
+                    prompt, group=str(guild.id) if guild else "", on_token=stream
+                )
+            except CircuitOpenError as e:
+                sender.cancel()
+                log_debug(self.bot, f"Chat-GPT unavailable: {e}")
+                await channel.send(
+                    f"Sorry {user}, I can't reach my AI service right now. "
+                    f"Please try again in {max(1, round(e.retry_in))} seconds."
+                )
+                return
+            except BaseException:
+                sender.cancel()
+                raise
+
+            if not messages:
+                sender.cancel()
+                raise ValueError("No response received from the agent.")
+
+            log_debug(self.bot, "Received response from OpenAI.")
+
+            for chunk in splitter.feed(stripper.close()) + splitter.close():
+                chunks.put_nowait(chunk)
+            chunks.put_nowait(None)
+            await sender
+
+        chat_agent.summarize_later(str(guild.id) if guild else "")
+        self.agents.mark_changed(agent_key, chat_agent)
+
+    async def send_chunks(self, channel: discord.abc.Messageable, chunks: asyncio.Queue) -> None:
+        """
+        Sends the chunks of a response as they are queued.
+        Args:
+          channel (discord.abc.Messageable): The channel to send them to.
+          chunks (asyncio.Queue): The chunks, ending with None.
+        """
+        while True:
+            chunk = await chunks.get()
+            if chunk is None:
+                return
+            await channel.send(chunk)
+            await asyncio.sleep(0.33)
+
     def get_ratelimit(self, message: discord.Message) -> Optional[float]:
         """
         Gets the rate limit for a given message.
@@ -34,7 +34,7 @@ class CoreCog(commands.Cog, name="Core Cog", description="The core cog for the b
         """Called when Bot is ready and connected to Discord."""
         try:
             await welcome_to_bot(self.bot)
-            await self.bot.start_terminal_command_loop()
+            self.bot.start_terminal_command_loop()
             log_debug(self.bot, "Bot is ready and connected to Discord.")
         except Exception as e:
             log_error(self.bot, f"Error welcoming Bot: {e}")
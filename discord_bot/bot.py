@@ -1,12 +1,15 @@
 import asyncio
 import json
 import os
-from typing import TYPE_CHECKING
+import signal
+from typing import TYPE_CHECKING, Coroutine
 
 from discord.ext import commands
 from dotenv import load_dotenv
 
 from discord_bot.terminal import terminal_command_loop
+from utils.ai import close_indexes
+from utils.mongo_db import close_handlers
 
 load_dotenv()
 
@@ -76,44 +79,119 @@ class Bot(commands.Bot):
         super().__init__(command_prefix=self.config.get("prefix"), intents=intents)
         self.log.debug("Bot initialized.")
         self.running = True
+        self.stopped = None
+        self.tasks = set()
+        self.terminal_task = None
 
     async def start_bot(self):
-        """Starts bot."""
+        """
+        Starts bot, and runs it until it is stopped.
+        Side Effects:
+          Stops the bot on SIGINT and SIGTERM, where the platform supports it.
+          Shuts the bot down gracefully once it is stopped.
+        """
         self.log.info("Bot starting...")
-        await self.load_cogs()
-
-        bot_task = asyncio.create_task(self.start(self.discord_token), name="bot")
+        self.stopped = asyncio.Event()
+        if not self.running:
+            self.stopped.set()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop_bot)
+            except (NotImplementedError, RuntimeError):
+                pass
 
         try:
-            while self.running:
-                await asyncio.sleep(0)
+            await self.load_cogs()
+            self.spawn(self.start(self.discord_token), "bot", critical=True)
+            await self.stopped.wait()
 
         except Exception as e:
             self.log.error(f"Bot encountered an error: {e}")
 
         finally:
-            bot_task.cancel()
-            
-    async def start_terminal_command_loop(self):
-        """Starts the terminal command loop."""
+            await self.shutdown()
+
+    def start_terminal_command_loop(self):
+        """
+        Starts the terminal command loop, unless it is already running.
+        Notes:
+          on_ready fires again after every reconnect, so this may be called more than once.
+        """
+        if self.terminal_task is not None and not self.terminal_task.done():
+            return
         self.log.debug("Starting terminal command loop...")
-        
-        terminal_task = asyncio.create_task(terminal_command_loop(self), name="terminal")
-        
-        try:
-            while self.running:
-                await asyncio.sleep(0)
-        
-        except Exception as e:
-            self.log.error(f"Terminal encountered an error: {e}")
-        
-        finally:
-            terminal_task.cancel()
+        self.terminal_task = self.spawn(terminal_command_loop(self), "terminal")
+
+    def spawn(self, coro: Coroutine, name: str, critical: bool = False) -> asyncio.Task:
+        """
+        Starts a supervised task.
+        Args:
+          coro (Coroutine): The coroutine to run.
+          name (str): The name of the task, for logging.
+          critical (bool): Whether the bot stops when the task ends.
+        Returns:
+          asyncio.Task: The task, cancelled on shutdown if it is still running.
+        """
+        task = asyncio.create_task(coro, name=name)
+        self.tasks.add(task)
+
+        def done(task: asyncio.Task) -> None:
+            self.tasks.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                self.log.error(f"{name.capitalize()} encountered an error: {task.exception()}")
+            if critical and self.running:
+                self.stop_bot()
+
+        task.add_done_callback(done)
+        return task
 
     def stop_bot(self):
         """Stops bot."""
+        if not self.running:
+            return
         self.log.info("Bot stopping...")
         self.running = False
+        if self.stopped is not None:
+            self.stopped.set()
+
+    async def shutdown(self):
+        """
+        Shuts the bot down gracefully.
+        Side Effects:
+          Waits up to shutdown_timeout seconds for the cogs to finish in-flight replies,
+          closes the Discord connection, which unloads the cogs, cancels the remaining tasks,
+          closes the MongoDB and Pinecone clients, and flushes the logs.
+        """
+        self.running = False
+        self.log.info("Bot shutting down...")
+        drains = [cog.drain() for cog in self.cogs.values() if hasattr(cog, "drain")]
+        if drains:
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*drains), self.config.get("shutdown_timeout", 30)
+                )
+            except asyncio.TimeoutError:
+                self.log.warning("Timed out waiting for in-flight replies.")
+
+        try:
+            await self.close()
+        except Exception as e:
+            self.log.error(f"Error closing the Discord connection: {e}")
+
+        tasks = [task for task in self.tasks if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for name, close in (("MongoDB", close_handlers), ("Pinecone", close_indexes)):
+            try:
+                close()
+            except Exception as e:
+                self.log.error(f"Error closing the {name} clients: {e}")
+
+        self.log.info("Bot stopped.")
+        self.log.flush()
 
     async def load_cogs(self):
         """Loads all cogs in the cogs directory and its subdirectories."""
@@ -1,8 +1,10 @@
 
+import atexit
 import logging
 import os
+import queue
 import re
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 from typing import TYPE_CHECKING
 
@@ -62,6 +64,9 @@ class Logger(logging.Logger):
           None
         Returns:
           None
+        Notes:
+          Records are queued and written to the file and console by a background thread,
+          so logging never waits on I/O.
         Examples:
           >>> logger.setup_logger()
         """
@@ -77,8 +82,37 @@ class Logger(logging.Logger):
         file_handler.setLevel(self.level)
         console_handler.setLevel(self.level)
 
-        self.addHandler(file_handler)
-        self.addHandler(console_handler)
+        self.queue = queue.SimpleQueue()
+        self.listener = QueueListener(
+            self.queue, file_handler, console_handler, respect_handler_level=True
+        )
+        self.addHandler(QueueHandler(self.queue))
+        self.listener.start()
+        self.listening = True
+        atexit.register(self.stop)
+
+    def flush(self):
+        """
+        Writes out every queued record, then goes on logging in the background.
+        Examples:
+          >>> logger.flush()
+        """
+        if self.listening:
+            self.listener.stop()
+            self.listener.start()
+
+    def stop(self):
+        """
+        Writes out every queued record and stops the background writer.
+        Side Effects:
+          Closes the log file.
+        """
+        if not self.listening:
+            return
+        self.listening = False
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
 
 
 class LoggerFormat(logging.Formatter):
@@ -112,6 +146,22 @@ class LoggerFormat(logging.Formatter):
         logging.CRITICAL: red + bold,
     }
 
+    FORMAT = "(black){asctime}(reset) (levelcolor){levelname: <8}(black)[(reset)(purple)Discord-AI(black)] >(reset) {message}"
+
+    def __init__(self):
+        """
+        Initializes the LoggerFormat class, building a formatter for each level.
+        """
+        super().__init__()
+        self.formatters = {}
+        for level, log_color in self.COLORS.items():
+            format = self.FORMAT.replace("(black)", self.black + self.bold)
+            format = format.replace("(reset)", self.reset)
+            format = format.replace("(gray)", self.gray + self.bold)
+            format = format.replace("(levelcolor)", log_color)
+            format = format.replace("(purple)", self.purple + self.bold)
+            self.formatters[level] = logging.Formatter(format, "%Y-%m-%d %H:%M:%S", style="{")
+
     def format(self, record: logging.LogRecord):
         """
         Formats the log messages.
@@ -124,14 +174,7 @@ class LoggerFormat(logging.Formatter):
           >>> formatter.format(logging.LogRecord('my_logger', logging.INFO, 'my_message'))
           '(black)2020-09-09 12:00:00(reset) (levelcolor)INFO     (black)[(reset)(purple)Discord-AI(black)] >(reset) my_message'
         """
-        log_color = self.COLORS[record.levelno]
-        format = "(black){asctime}(reset) (levelcolor){levelname: <8}(black)[(reset)(purple)Discord-AI(black)] >(reset) {message}"
-        format = format.replace("(black)", self.black + self.bold)
-        format = format.replace("(reset)", self.reset)
-        format = format.replace("(gray)", self.gray + self.bold)
-        format = format.replace("(levelcolor)", log_color)
-        format = format.replace("(purple)", self.purple + self.bold)
-        formatter = logging.Formatter(format, "%Y-%m-%d %H:%M:%S", style="{")
+        formatter = self.formatters.get(record.levelno) or self.formatters[logging.INFO]
         return formatter.format(record)
 
 
@@ -147,11 +190,13 @@ class LoggerRotator(RotatingFileHandler):
     Returns:
       None
     Examples:
-      >>> logger_rotator = LoggerRotator(log_file='/path/to/log.log', mode='a', maxBytes=0, backupCount=0, encoding=None)
+      >>> logger_rotator = LoggerRotator(log_file='/path/to/log.log', mode='a', maxBytes=0, backupCount=0, encoding='utf-8')
     """
 
+    ANSI_ESCAPE = re.compile(r"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])")
+
     def __init__(
-        self, log_file: Path, mode="a", maxBytes=0, backupCount=0, encoding=None
+        self, log_file: Path, mode="a", maxBytes=0, backupCount=0, encoding="utf-8"
     ):
         """
         Initializes the LoggerRotator class.
@@ -164,7 +209,7 @@ class LoggerRotator(RotatingFileHandler):
         Returns:
           None
         Examples:
-          >>> logger_rotator = LoggerRotator(log_file='/path/to/log.log', mode='a', maxBytes=0, backupCount=0, encoding=None)
+          >>> logger_rotator = LoggerRotator(log_file='/path/to/log.log', mode='a', maxBytes=0, backupCount=0, encoding='utf-8')
         """
         self.log_file = log_file
 
@@ -181,26 +226,19 @@ class LoggerRotator(RotatingFileHandler):
         self.backupCount = backupCount
         self.encoding = encoding
 
-    def emit(self, record: logging.LogRecord):
+    def format(self, record: logging.LogRecord):
         """
-        Writes the log message to the log file.
+        Formats the log message without its colors.
         Args:
-          record (logging.LogRecord): The log record to write.
+          record (logging.LogRecord): The log record to format.
         Returns:
-          None
+          str: The formatted log message.
+        Notes:
+          The file is kept open between records, and rotated once it reaches maxBytes.
         Examples:
-          >>> logger_rotator.emit(logging.LogRecord('my_logger', logging.INFO, 'my_message'))
+          >>> logger_rotator.format(logging.LogRecord('my_logger', logging.INFO, 'my_message'))
         """
-        ansi_escape = re.compile(r"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])")
-
-        try:
-            msg = self.format(record)
-            msg = ansi_escape.sub("", msg)
-            with open(self.baseFilename, "a", encoding="utf-8") as f:
-                f.write(msg + self.terminator)
-
-        except Exception:
-            self.handleError(record)
+        return self.ANSI_ESCAPE.sub("", super().format(record))
 
 
 def log_debug(bot: "Bot", message: str) -> None:
@@ -1,11 +1,13 @@
 import asyncio
+import threading
 from typing import TYPE_CHECKING
 
 from discord_bot.terminal_cmds import (exit_bot_terminal, ping, set_bot_avatar,
                                        set_bot_name, set_bot_presence,
                                        set_owner, set_persona, show_aliases,
-                                       show_help, sync_commands,
-                                       toggle_debug_mode, wipe_config)
+                                       show_breakers, show_help, show_metrics,
+                                       sync_commands, toggle_debug_mode,
+                                       wipe_config)
 
 if TYPE_CHECKING:
     from discord_bot.bot import Bot
@@ -23,7 +25,6 @@ async def terminal_command_loop(bot: "Bot"):
     """
     owner_name = bot.config.get("owner_name")
     bot_name = bot.config.get("bot_name")
-    loop = asyncio.get_event_loop()
     delay = 0.25
     black = "\x1b[30m"
     red = "\x1b[31m"
@@ -40,11 +41,50 @@ async def terminal_command_loop(bot: "Bot"):
         terminal_format = f"{bold}{green}{owner_name}{reset}{bold}{black}@{reset}{bold}{purple}{bot_name}{reset}"
         terminal_prompt = f"{terminal_format}{black}{bold}: > {reset}"
 
-        terminal_command = loop.run_in_executor(None, input, terminal_prompt)
+        terminal_command = await read_line(terminal_prompt)
+        if not bot.running:
+            break
 
-        command_handler = TerminalCommands(bot, await terminal_command)
+        command_handler = TerminalCommands(bot, terminal_command)
         await command_handler.handle_terminal_command()
 
+
+async def read_line(prompt: str) -> str:
+    """
+    Reads a line from the terminal without blocking the event loop.
+    Args:
+      prompt (str): The prompt to display.
+    Returns:
+      str: The line entered.
+    Notes:
+      The line is read on a daemon thread, so a read still waiting at shutdown does not keep the process alive.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve(line: str, error: BaseException) -> None:
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(line)
+
+    def read() -> None:
+        line, error = "", None
+        try:
+            line = input(prompt)
+        except Exception as e:
+            error = e
+        try:
+            loop.call_soon_threadsafe(resolve, line, error)
+        except RuntimeError:
+            pass
+
+    threading.Thread(target=read, name="terminal-input", daemon=True).start()
+    return await future
+
+
 class TerminalCommands:
     """
     Initializes the TerminalCommands class.
@@ -125,5 +165,13 @@ class TerminalCommands:
             self.bot.log.debug("Toggling debug mode...")
             toggle_debug_mode(self.bot)
 
+        elif user_command in ["metrics", "stats", "m"]:
+            self.bot.log.debug("Showing metrics...")
+            show_metrics(self.bot)
+
+        elif user_command in ["breakers", "circuits", "cb"]:
+            self.bot.log.debug("Showing circuit breakers...")
+            show_breakers(self.bot)
+
         else:
             self.bot.log.info(f"{user_command} is not a recognized command.")
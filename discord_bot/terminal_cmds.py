@@ -5,6 +5,9 @@ from typing import TYPE_CHECKING
 
 import discord
 
+from utils.breaker import breakers
+from utils.metrics import metrics
+from utils.prompts import set_persona as apply_persona
 from utils.tools import get_boolean_input, update_config
 
 if TYPE_CHECKING:
@@ -391,6 +394,7 @@ async def set_persona(bot: "Bot") -> None:
                     "persona": new_persona,
                 }
                 update_config(config_file, new_data)
+                apply_persona(bot, new_persona)
 
             except Exception as e:
                 bot.log.debug(f"Failed to update the configuration file: {e}")
@@ -437,6 +441,8 @@ def show_help(bot: "Bot") -> None:
         "wipebot": 'Wipes the bot"s configuration files.',
         "aliases": "Lists all command aliases.",
         "debug": "Toggles debug mode.",
+        "metrics": "Shows cache, latency and queue metrics.",
+        "breakers": "Shows the circuit breaker of each service.",
     }
 
     try:
@@ -496,6 +502,8 @@ def show_aliases(bot: "Bot") -> None:
         "wipebot": ["wipeconfig", "wipe", "wb"],
         "alias": ["aliases", "a"],
         "debug": ["d"],
+        "metrics": ["stats", "m"],
+        "breakers": ["circuits", "cb"],
     }
 
     try:
@@ -521,6 +529,93 @@ def show_aliases(bot: "Bot") -> None:
         traceback.print_exc()
 
 
+def show_metrics(bot: "Bot") -> None:
+    """
+    Prints the bot's runtime metrics.
+    Args:
+      bot (Bot): The bot instance.
+    Side Effects:
+      Prints every counter, gauge and latency percentile to the console.
+    Examples:
+      >>> show_metrics(bot)
+      askdb_cache_hits              - 12
+    """
+    black = "\u001b[30m"
+    purple = "\u001b[35m"
+    green = "\u001b[32m"
+    bold = "\u001b[1m"
+    reset = "\u001b[0m"
+
+    try:
+        bot.log.debug("Starting show_metrics function...")
+        bot.log.info(
+            f"{black}{'-' * 24}[ {purple}{bold}Metrics{reset}{black} ]{'-' * 24}{reset}"
+        )
+        bot.log.info("")
+
+        snapshot = metrics.snapshot()
+        if not snapshot:
+            bot.log.info("Nothing recorded yet.")
+
+        for name, value in sorted(snapshot.items()):
+            bot.log.info(f"{green}{name}{' ' * (30 - len(name))}{black}- {value}{reset}")
+        bot.log.info("")
+        bot.log.info(
+            f"{black}{'-' * 22}[ {purple}{bold}End metrics{reset}{black} ]{'-' * 22}{reset}"
+        )
+        bot.log.debug("Exiting show_metrics function...")
+
+    except Exception as e:
+        bot.log.error(f"Error in show_metrics function: {e}")
+        traceback.print_exc()
+
+
+def show_breakers(bot: "Bot") -> None:
+    """
+    Prints the state of the circuit breaker of each service.
+    Args:
+      bot (Bot): The bot instance.
+    Side Effects:
+      Prints the state, consecutive failures and current timeouts of each breaker to the console.
+    Examples:
+      >>> show_breakers(bot)
+      openai                        - closed, 0 failures, timeout chat 12.4s, embed 2s
+    """
+    black = "\u001b[30m"
+    purple = "\u001b[35m"
+    green = "\u001b[32m"
+    red = "\u001b[31m"
+    bold = "\u001b[1m"
+    reset = "\u001b[0m"
+
+    try:
+        bot.log.debug("Starting show_breakers function...")
+        bot.log.info(
+            f"{black}{'-' * 24}[ {purple}{bold}Circuit breakers{reset}{black} ]{'-' * 24}{reset}"
+        )
+        bot.log.info("")
+
+        for name, breaker in breakers.items():
+            status = breaker.status()
+            color = green if status["state"] == "closed" else red
+            timeouts = ", ".join(
+                f"{kind + ' ' if kind else ''}{timeout}s" for kind, timeout in status["timeouts"].items()
+            )
+            bot.log.info(
+                f"{color}{name}{' ' * (30 - len(name))}{black}- {status['state']}, "
+                f"{status['failures']} failures, timeout {timeouts}{reset}"
+            )
+        bot.log.info("")
+        bot.log.info(
+            f"{black}{'-' * 22}[ {purple}{bold}End circuit breakers{reset}{black} ]{'-' * 22}{reset}"
+        )
+        bot.log.debug("Exiting show_breakers function...")
+
+    except Exception as e:
+        bot.log.error(f"Error in show_breakers function: {e}")
+        traceback.print_exc()
+
+
 def ping(bot: "Bot") -> None:
     """
     Prints 'Pong!' to the console.
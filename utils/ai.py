@@ -1,22 +1,36 @@
-from typing import TYPE_CHECKING
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from typing import (TYPE_CHECKING, Any, Awaitable, Callable, List, Optional,
+                    Tuple, Union)
 
 import pinecone
 from langchain import LLMChain, OpenAI, PromptTemplate
-from langchain.chains import ConversationalRetrievalChain, ConversationChain
+from langchain.callbacks import get_openai_callback
+from langchain.callbacks.base import AsyncCallbackHandler
+from langchain.chains import ConversationChain
+from langchain.chains.conversational_retrieval.base import _get_chat_history as get_chat_history
 from langchain.chains.question_answering import load_qa_chain
 from langchain.chat_models import ChatOpenAI
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.memory import ConversationBufferWindowMemory
-from langchain.prompts.chat import (ChatPromptTemplate,
-                                    HumanMessagePromptTemplate,
-                                    MessagesPlaceholder,
-                                    SystemMessagePromptTemplate)
-from langchain.vectorstores import Pinecone
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain.schema import Document
 
 from discord_bot.logger import log_debug, log_error, log_info
+from utils.breaker import OPENAI_ERRORS, CircuitOpenError, get_breaker, report_progress
+from utils.completion_cache import cache_lookups, use_cache
+from utils.context import count_tokens, doc_tokens, pack_documents
+from utils.embeddings import get_embedder
+from utils.hedge import get_hedger
+from utils.memory import TokenBudgetMemory
+from utils.metrics import metrics
+from utils.prompts import get_prompts
+from utils.ratelimit import get_limiter
 
 if TYPE_CHECKING:
     from discord_bot.bot import Bot
+    from utils.cache import AnswerCache
+    from utils.mongo_db import MongoDBHandler
 
 
 class ChatAgent:
@@ -29,39 +43,59 @@ class ChatAgent:
         Initializes a ChatAgent instance.
         Args:
           bot (Bot): The bot instance.
-          channel_id (str): The channel ID.
+          channel_id (str): The ID of the channel or thread the conversation is in.
           temperature (float): The temperature for OpenAI predictions.
           return_messages (bool): Whether to return messages.
-        Side Effects:
-          Reads the preprompt from the configs directory.
         Notes:
-          The preprompt is replaced with the bot's persona.
+          The preprompt comes compiled from the prompt registry, with the bot's persona filled in.
+          The last chat_memory_tokens tokens of the conversation are kept verbatim,
+          older messages are summarized in the background by summarize_later.
+          The LLMs stream, so replies can be posted as they are generated, and slow ones hedged.
         """
         self.bot = bot
         client = self.bot.openai_api_key
         model = self.bot.openai_model
         self.channel_id = channel_id
 
-        with open(self.bot.paths["configs"] / "preprompt", "r") as f:
-            preprompt = f.read()
-
-        preprompt = preprompt.replace("{persona}", bot.config.get("persona"))
+        self.compiled = get_prompts(bot).get("preprompt", bot.config.get("persona"), str(model))
+        self.preprompt = self.compiled.text
+        self.prompt = self.compiled.template
 
-        self.prompt = ChatPromptTemplate.from_messages(
-            [
-                SystemMessagePromptTemplate.from_template(f"{preprompt}"),
-                MessagesPlaceholder(variable_name=channel_id),
-                HumanMessagePromptTemplate.from_template("{input}"),
-            ]
+        self.hedger = get_hedger(bot, "chat")
+        self.llm = ChatOpenAI(
+            client=client,
+            model=str(model),
+            temperature=temperature,
+            streaming=True,
+            cache=use_cache(bot, "chat", temperature),
         )
-
-        self.llm = ChatOpenAI(client=client, model=str(model), temperature=temperature)
-        memory = ConversationBufferWindowMemory(
-            k=3, memory_key=channel_id, return_messages=return_messages
+        self.memory = TokenBudgetMemory(
+            max_tokens=bot.config.get("chat_memory_tokens", 1000),
+            model=str(model),
+            memory_key="history",
+            return_messages=return_messages,
         )
         self.conversation = ConversationChain(
-            memory=memory, prompt=self.prompt, llm=self.llm, verbose=True
+            memory=self.memory,
+            prompt=self.prompt,
+            llm=self.llm,
+            verbose=bot.config.get("langchain_verbose", False),
         )
+        self.memory = self.conversation.memory
+        self.summarizer = LLMChain(
+            llm=ChatOpenAI(
+                client=client,
+                model=str(model),
+                temperature=0,
+                max_tokens=bot.config.get("chat_summary_tokens", 256),
+                cache=use_cache(bot, "summary", 0),
+            ),
+            prompt=SUMMARY_PROMPT,
+        )
+        self.summary_task = None
+        self.temperature = temperature
+        self.router = get_router(bot)
+        self.llms = {"strong": self.llm}
 
     def predict(self, prompt: str):
         """
@@ -74,32 +108,500 @@ class ChatAgent:
           >>> agent.predict("Hello!")
           "Hi there!"
         """
+        self.refresh_prompt()
         response = self.conversation.predict(input=prompt)
         return response
 
+    async def apredict(
+        self,
+        prompt: str,
+        group: str = "",
+        on_token: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """
+        Predicts a response to a prompt without blocking the event loop.
+        Args:
+          prompt (str): The prompt to respond to.
+          group (str): The guild the prompt came from, for fair rate limiting.
+          on_token (Callable, optional): Called with the text of the response as it is generated.
+        Returns:
+          str: The predicted response.
+        Notes:
+          The model router picks the model. A fast model response that declines to answer
+          is thrown away and the prompt is answered again by the strong model, so fast model
+          responses reach on_token only once they are kept. A response from the completion
+          cache reaches on_token whole.
+        Examples:
+          >>> await agent.apredict("Hello!", "123")
+          "Hi there!"
+        """
+        self.refresh_prompt()
+        streamed = False
+
+        def stream(token: str) -> None:
+            nonlocal streamed
+            streamed = True
+            on_token(token)
+
+        tier = self.router.route(prompt, self.channel_id)
+        live = stream if on_token is not None else None
+        response = await self.generate(prompt, group, tier, live if tier == "strong" else None)
+        if tier == "fast" and self.router.declined(response):
+            metrics.incr("router_escalations")
+            response = await self.generate(prompt, group, "strong", live)
+        if on_token is not None and not streamed:
+            on_token(response)
+
+        self.memory.save_context({"input": prompt}, {"response": response})
+        return response
+
+    async def generate(
+        self,
+        prompt: str,
+        group: str,
+        tier: str,
+        on_token: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """
+        Generates a response to a prompt with the model of a tier, without saving it to memory.
+        Args:
+          prompt (str): The prompt to respond to.
+          group (str): The guild the prompt came from, for fair rate limiting.
+          tier (str): "fast" or "strong".
+          on_token (Callable, optional): Called with every token of the response as it is generated.
+        Returns:
+          str: The response.
+        Notes:
+          The request is hedged: a duplicate is sent if the first has no token by the hedger's deadline.
+        """
+        model = self.bot.openai_model
+        messages = self.prompt.format_messages(input=prompt, **self.memory.load_memory_variables({}))
+        prompt_tokens = (
+            self.compiled.tokens
+            + self.memory.tokens
+            + count_tokens(prompt, model)
+        )
+        llm = self.llms.get(tier)
+        if llm is None:
+            llm = self.llms[tier] = ChatOpenAI(
+                client=self.bot.openai_api_key,
+                model=self.router.model(tier),
+                temperature=self.temperature,
+                streaming=True,
+                cache=use_cache(self.bot, "chat", self.temperature),
+            )
+
+        async def timed(on_token):
+            started = time.monotonic()
+            response = await llm.apredict_messages(messages, callbacks=[TokenStream(on_token)])
+            self.router.record(tier, time.monotonic() - started)
+            return response.content
+
+        return await self.hedger.run(
+            lambda stream, sent: openai_call(
+                self.bot, "chat", group, prompt_tokens, lambda: timed(stream), "chat", on_start=sent
+            ),
+            on_token,
+        )
+
+    def refresh_prompt(self) -> None:
+        """
+        Switches the conversation to the current preprompt, if the file or the persona changed.
+        """
+        compiled = get_prompts(self.bot).get(
+            "preprompt", self.bot.config.get("persona"), str(self.bot.openai_model)
+        )
+        if compiled is not self.compiled:
+            self.compiled = compiled
+            self.preprompt = compiled.text
+            self.prompt = compiled.template
+            self.conversation.prompt = compiled.template
+
+    def summarize_later(self, group: str = "") -> None:
+        """
+        Starts summarizing the messages that no longer fit the memory's token budget, if there are any.
+        Args:
+          group (str): The guild the conversation is in, for fair rate limiting.
+        Notes:
+          Call this after the reply is sent, to keep summarizing off the response path.
+        """
+        if not self.memory.pending:
+            return
+        if self.summary_task is not None and not self.summary_task.done():
+            return
+        self.summary_task = asyncio.create_task(self.summarize(group))
+
+    async def summarize(self, group: str = "") -> None:
+        """
+        Folds the pending messages into the conversation summary, as lowest priority work.
+        Args:
+          group (str): The guild the conversation is in, for fair rate limiting.
+        """
+        model = self.bot.openai_model
+        prompt_tokens = (
+            count_tokens(SUMMARY_PROMPT.template + self.memory.summary, model)
+            + sum(count_tokens(message.content, model) for message in self.memory.pending)
+        )
+        try:
+            await openai_call(
+                self.bot,
+                "ingest",
+                group,
+                prompt_tokens,
+                lambda: self.memory.asummarize(self.summarizer),
+                "summary",
+            )
+        except Exception as e:
+            log_error(self.bot, f"Error summarizing conversation {self.channel_id}: {e}")
+
+
+class ModelRouter:
+    """
+    Picks a fast or a strong model for each prompt.
+    """
+
+    HARD = re.compile(
+        r"```|\b(?:how|why|explain|implement|write|code|debug|error|traceback|exception|"
+        r"compare|difference|install|configure|step)\b",
+        re.IGNORECASE,
+    )
+    DECLINED = re.compile(
+        r"\b(?:I (?:don't|do not) know|I'm not sure|I am not sure|I (?:can't|cannot) (?:answer|help)|"
+        r"lack the context)\b",
+        re.IGNORECASE,
+    )
+
+    def __init__(
+        self,
+        strong_model: str,
+        fast_model: str = "gpt-3.5-turbo",
+        enabled: bool = False,
+        fast_max_tokens: int = 40,
+        channels: Optional[dict] = None,
+    ):
+        """
+        Initializes the ModelRouter class.
+        Args:
+          strong_model (str): The model for hard prompts.
+          fast_model (str): The model for short, simple prompts.
+          enabled (bool): Whether to route at all. When off, every prompt goes to the strong model.
+          fast_max_tokens (int): The longest prompt, in tokens, the fast model may get.
+          channels (dict, optional): Tiers forced per channel ID, "fast" or "strong".
+        """
+        self.models = {"fast": fast_model, "strong": strong_model}
+        self.enabled = enabled
+        self.fast_max_tokens = fast_max_tokens
+        self.channels = channels or {}
+
+    def route(self, prompt: str, channel_id: str = "") -> str:
+        """
+        Picks the tier of a prompt.
+        Args:
+          prompt (str): The prompt.
+          channel_id (str): The channel the prompt was sent in.
+        Returns:
+          str: "fast" for short prompts that look simple, otherwise "strong".
+        Examples:
+          >>> router.route("hi there!")
+          'fast'
+          >>> router.route("How do I install gpt-engineer on windows?")
+          'strong'
+        """
+        if not self.enabled:
+            return "strong"
+        if str(channel_id) in self.channels:
+            tier = self.channels[str(channel_id)]
+        elif (
+            count_tokens(prompt, self.models["fast"]) <= self.fast_max_tokens
+            and prompt.count("\n") < 2
+            and not self.HARD.search(prompt)
+        ):
+            tier = "fast"
+        else:
+            tier = "strong"
+        metrics.incr(f"router_{tier}")
+        return tier
+
+    def model(self, tier: str) -> str:
+        """
+        Gets the model of a tier.
+        Args:
+          tier (str): "fast" or "strong".
+        Returns:
+          str: The model name.
+        """
+        return self.models[tier]
+
+    def declined(self, response: str) -> bool:
+        """
+        Checks whether a response declines to answer.
+        Args:
+          response (str): The response.
+        Returns:
+          bool: True if the response says it does not know.
+        """
+        return bool(self.DECLINED.search(response))
+
+    def record(self, tier: str, latency: float) -> None:
+        """
+        Records the latency of a completion.
+        Args:
+          tier (str): The tier of the model that completed.
+          latency (float): The latency in seconds.
+        """
+        metrics.observe(f"model_{tier}_latency", latency)
+
+
+_routers = {}
+
+
+def get_router(bot: "Bot") -> ModelRouter:
+    """
+    Gets the model router shared by the whole bot.
+    Args:
+      bot (Bot): The bot instance.
+    Returns:
+      ModelRouter: The router.
+    """
+    if bot.openai_api_key not in _routers:
+        _routers[bot.openai_api_key] = ModelRouter(
+            str(bot.openai_model),
+            fast_model=bot.config.get("openai_fast_model", "gpt-3.5-turbo"),
+            enabled=bot.config.get("model_routing", False),
+            fast_max_tokens=bot.config.get("router_fast_max_tokens", 40),
+            channels=bot.config.get("router_channels", {}),
+        )
+    return _routers[bot.openai_api_key]
+
+
+class ChatAgentPool:
+    """
+    Bounded set of chat conversations, one ChatAgent per (guild, channel or thread).
+    """
+
+    def __init__(
+        self,
+        bot: "Bot",
+        max_agents: int = 1000,
+        ttl: float = 3600,
+        handler: Optional["MongoDBHandler"] = None,
+        flush_interval: float = 5,
+        store_ttl: float = 604800,
+    ):
+        """
+        Initializes the ChatAgentPool class.
+        Args:
+          bot (Bot): The bot instance.
+          max_agents (int): The most conversations kept in memory.
+          ttl (float): Seconds of inactivity after which a conversation is evicted from memory.
+          handler (MongoDBHandler, optional): Store that conversations are saved to and loaded from.
+          flush_interval (float): Seconds between batched writes of changed conversations.
+          store_ttl (float): Seconds of inactivity after which a saved conversation is removed.
+        """
+        self.bot = bot
+        self.max_agents = max_agents
+        self.ttl = ttl
+        self.handler = handler
+        self.flush_interval = flush_interval
+        self.store_ttl = store_ttl
+        self.agents = OrderedDict()
+        self.dirty = set()
+        self.unsaved = {}
+        self.flusher = None
+
+    async def get(self, key: Tuple[int, int]) -> ChatAgent:
+        """
+        Gets the agent of a conversation, loading it from the store or starting a new one if it is not in memory.
+        Args:
+          key (tuple): The (guild ID, channel or thread ID) of the conversation.
+        Returns:
+          ChatAgent: The agent, with its own memory.
+        Side Effects:
+          Evicts idle conversations, and the least recently used ones beyond max_agents.
+        Examples:
+          >>> await pool.get((123, 456))
+          <ChatAgent>
+        """
+        now = time.monotonic()
+        entry = self.agents.get(key)
+        if entry is not None and now - entry["used"] > self.ttl:
+            self.evict(key, self.agents.pop(key))
+            entry = None
+        if entry is None:
+            entry = {"agent": await self.load(key)}
+            self.agents[key] = entry
+        entry["used"] = now
+        self.agents.move_to_end(key)
+
+        while len(self.agents) > self.max_agents:
+            self.evict(*self.agents.popitem(last=False))
+        while self.agents and now - next(iter(self.agents.values()))["used"] > self.ttl:
+            self.evict(*self.agents.popitem(last=False))
+        return entry["agent"]
+
+    async def load(self, key: Tuple[int, int]) -> ChatAgent:
+        """
+        Starts the agent of a conversation, restoring its memory from the store if it was saved.
+        Args:
+          key (tuple): The (guild ID, channel or thread ID) of the conversation.
+        Returns:
+          ChatAgent: The agent.
+        """
+        agent = ChatAgent(self.bot, str(key[1]))
+        store_key = f"{key[0]}:{key[1]}"
+        blob = self.unsaved.get(store_key)
+        if blob is None and self.handler is not None:
+            try:
+                blob = await asyncio.to_thread(self.handler.load_chat, store_key)
+            except Exception as e:
+                log_error(self.bot, f"Error loading conversation {store_key}: {e}")
+        if blob is not None:
+            agent.memory.loads(blob)
+        return agent
+
+    def mark_changed(self, key: Tuple[int, int], agent: ChatAgent) -> None:
+        """
+        Schedules a conversation to be saved with the next batch.
+        Args:
+          key (tuple): The (guild ID, channel or thread ID) of the conversation.
+          agent (ChatAgent): The agent whose conversation changed.
+        Notes:
+          A conversation evicted while its reply was being generated is serialized right away,
+          so its last exchange is saved with the next batch.
+        """
+        if self.handler is None:
+            return
+        entry = self.agents.get(key)
+        if entry is not None and entry["agent"] is agent:
+            self.dirty.add(key)
+        else:
+            self.unsaved[f"{key[0]}:{key[1]}"] = agent.memory.dumps()
+        if self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.create_task(self.flush_later())
+
+    def evict(self, key: Tuple[int, int], entry: dict) -> None:
+        """
+        Keeps the serialized memory of an evicted conversation until the next batch saves it.
+        Args:
+          key (tuple): The (guild ID, channel or thread ID) of the conversation.
+          entry (dict): The evicted entry.
+        """
+        if key in self.dirty:
+            self.dirty.discard(key)
+            self.unsaved[f"{key[0]}:{key[1]}"] = entry["agent"].memory.dumps()
+
+    async def flush_later(self) -> None:
+        """
+        Saves the changed conversations every flush_interval seconds until none are left.
+        """
+        while self.dirty or self.unsaved:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self, force: bool = False) -> None:
+        """
+        Saves every changed conversation in one batch.
+        Args:
+          force (bool): Also save the conversations whose summary is still being generated, for when
+            there is no later batch, such as at shutdown.
+        Notes:
+          A conversation whose summary is still being generated is otherwise saved with a later batch.
+          Saving it early is safe, since the messages waiting to be summarized are saved as pending.
+        """
+        chats = dict(self.unsaved)
+        for key in list(self.dirty):
+            entry = self.agents.get(key)
+            if entry is None:
+                self.dirty.discard(key)
+                continue
+            agent = entry["agent"]
+            if not force and agent.summary_task is not None and not agent.summary_task.done():
+                continue
+            self.dirty.discard(key)
+            chats[f"{key[0]}:{key[1]}"] = agent.memory.dumps()
+        if not chats:
+            return
+
+        try:
+            await asyncio.to_thread(self.handler.save_chats, chats, ttl=self.store_ttl)
+        except Exception as e:
+            log_error(self.bot, f"Error saving {len(chats)} conversations: {e}")
+            self.unsaved.update(chats)
+            return
+        for store_key, blob in chats.items():
+            if self.unsaved.get(store_key) is blob:
+                del self.unsaved[store_key]
+
+
+class TokenStream(AsyncCallbackHandler):
+    """
+    Callback handler that passes each generated token to a function.
+    """
+
+    def __init__(self, on_token: Callable[[str], None]):
+        """
+        Initializes the TokenStream class.
+        Args:
+          on_token (Callable): Called with every new token.
+        """
+        self.on_token = on_token
+
+    async def on_llm_new_token(self, token: str, **kwargs) -> None:
+        """
+        Passes a new token on.
+        Args:
+          token (str): The new token.
+        Side Effects:
+          Reports the call's progress to its circuit breaker.
+        """
+        report_progress()
+        self.on_token(token)
+
 
 class ChatQuery:
     """
     Class for creating a query for a chatbot.
     """
 
-    def __init__(self, bot: "Bot", namespace: str):
+    def __init__(
+        self,
+        bot: "Bot",
+        namespace: Union[str, List[str]],
+        cache: Optional["AnswerCache"] = None,
+        group: str = "",
+        channel: str = "",
+    ):
         """
         Initializes the ChatQuery class.
         Args:
           bot (Bot): The bot object.
-          namespace (str): The namespace for the query.
+          namespace (str | list): The namespace, or namespaces, for the query.
+          cache (AnswerCache, optional): The answer cache shared between queries.
+          group (str): The guild the query came from, for fair rate limiting.
+          channel (str): The channel the query came from, for model routing.
         Side Effects:
-          Initializes the LLM, QA Prompt, LLM Chain, ChatOpenAI, OpenAIEmbeddings, Pinecone, and ConversationalRetrievalChain objects.
+          Initializes the LLM, QA Prompt, LLM Chain, ChatOpenAI, and Pinecone objects.
         """
         log_debug(bot, "Loading LLM Query")
-        self.llm = OpenAI(temperature=0, openai_api_key=bot.openai_api_key)
+        self.bot = bot
+        self.group = group
+        self.channel = channel
+        self.router = get_router(bot)
+        self.model = bot.openai_model
+        self.fetch_k = bot.config.get("askdb_fetch_k", 12)
+        self.token_budget = bot.config.get("askdb_context_tokens", 3000)
+        self.llm = OpenAI(
+            temperature=0,
+            openai_api_key=bot.openai_api_key,
+            cache=use_cache(bot, "condense", 0),
+        )
         self.streaming_llm = ChatOpenAI(
             streaming=True,
             model_name=bot.openai_model,
             openai_api_key=bot.openai_api_key,
             temperature=0,
-            verbose=True,
+            verbose=bot.config.get("langchain_verbose", False),
+            cache=use_cache(bot, "answer", 0),
         )
 
         QA_V2 = """You are a helpful AI assistant. Use the following pieces of context to answer the question at the end.
@@ -132,32 +634,330 @@ class ChatQuery:
         self.doc_chain = load_qa_chain(
             self.streaming_llm, chain_type="stuff", prompt=self.qap
         )
+        self.doc_chains = {"strong": self.doc_chain}
 
-        pinecone.init(api_key=bot.pinecone_api_key, environment=bot.pinecone_env)
-        self.embeddings = OpenAIEmbeddings(
-            model="text-embedding-ada-002", openai_api_key=bot.openai_api_key
+        self.embedder = get_embedder(bot)
+        self.index = get_index(bot)
+        self.namespaces = [namespace] if isinstance(namespace, str) else list(namespace)
+        self.namespace = ",".join(sorted(self.namespaces))
+        self.cache = cache
+
+    async def embed(self, text: str) -> List[float]:
+        """
+        Embeds a question, batched with other concurrent askdb questions.
+        Args:
+          text (str): The text to embed.
+        Returns:
+          list: The embedding of the text.
+        """
+        return await self.embedder.embed(text)
+
+    async def search(self, embedding: List[float]) -> List[Tuple[Document, float]]:
+        """
+        Searches every namespace for chunks relevant to an embedded question.
+        Args:
+          embedding (list): The embedding of the question.
+        Returns:
+          list: The best pairs of documents and relevance scores across all namespaces, most relevant first.
+        Notes:
+          Namespaces are searched concurrently. One that fails or exceeds the pinecone breaker's timeout is left out.
+        """
+        results = await asyncio.gather(
+            *[self.search_namespace(namespace, embedding) for namespace in self.namespaces],
+            return_exceptions=True,
         )
-        self.vectorstore = Pinecone.from_existing_index(
-            index_name=bot.pinecone_index,
-            embedding=self.embeddings,
-            text_key="text",
-            namespace=namespace,
+
+        docs_and_scores = []
+        for namespace, result in zip(self.namespaces, results):
+            if isinstance(result, BaseException):
+                log_error(self.bot, f"Error searching namespace {namespace}: {result!r}")
+                continue
+            docs_and_scores.extend(result)
+
+        if all(isinstance(result, BaseException) for result in results):
+            breaker_errors = [result for result in results if isinstance(result, CircuitOpenError)]
+            if breaker_errors:
+                raise breaker_errors[0]
+            raise RuntimeError("Every namespace search failed.")
+
+        docs_and_scores.sort(key=lambda pair: pair[1], reverse=True)
+        return docs_and_scores[: self.fetch_k]
+
+    async def search_namespace(self, namespace: str, embedding: List[float]) -> List[Tuple[Document, float]]:
+        """
+        Searches one namespace for chunks relevant to an embedded question.
+        Args:
+          namespace (str): The namespace to search.
+          embedding (list): The embedding of the question.
+        Returns:
+          list: Pairs of documents and relevance scores, most relevant first.
+        """
+        results = await get_breaker("pinecone").call(
+            lambda: asyncio.to_thread(
+                self.index.query,
+                [embedding],
+                top_k=self.fetch_k,
+                include_metadata=True,
+                namespace=namespace,
+            )
+        )
+        docs_and_scores = []
+        for match in results["matches"]:
+            metadata = dict(match["metadata"])
+            text = metadata.pop("text", None)
+            if text is not None:
+                metadata["namespace"] = namespace
+                docs_and_scores.append((Document(page_content=text, metadata=metadata), match["score"]))
+        return docs_and_scores
+
+    async def retrieve(self, question: str) -> Tuple[List[float], List[Tuple[Document, float]]]:
+        """
+        Embeds a question and searches the namespaces for it.
+        Args:
+          question (str): The question to search for.
+        Returns:
+          tuple: The embedding of the question, and pairs of documents and relevance scores.
+        """
+        embedding = await self.embed(question)
+        return embedding, await self.search(embedding)
+
+    async def condense(self, question: str, chat_history: list) -> str:
+        """
+        Rephrases a follow up question into a standalone question.
+        Args:
+          question (str): The follow up question.
+          chat_history (list): The (question, answer) pairs asked so far.
+        Returns:
+          str: The standalone question.
+        """
+        history = get_chat_history(chat_history)
+        prompt_tokens = count_tokens(self.cdp.template + history + question, self.model)
+        standalone = await openai_call(
+            self.bot,
+            "askdb",
+            self.group,
+            prompt_tokens,
+            lambda: self.question_generator.arun(question=question, chat_history=history),
+            "condense",
         )
+        return standalone.strip() or question
 
-        self.qa = ConversationalRetrievalChain(
-            retriever=self.vectorstore.as_retriever(
-                search_type="similarity", search_kwargs={"k": 6}
+    async def ask(
+        self,
+        question: str,
+        chat_history: list,
+        on_token: Optional[Callable[[str], None]] = None,
+    ) -> dict:
+        """
+        Answers a question using the documents in the namespaces.
+        Args:
+          question (str): The question to answer.
+          chat_history (list): The (question, answer) pairs asked so far.
+          on_token (Callable, optional): Called with every token of the answer as it is generated.
+        Returns:
+          dict: The answer, the question it was generated for, and the source documents.
+        Notes:
+          Without chat history the question is searched for directly, skipping the condense LLM call.
+          With chat history the raw question is searched for while it is being condensed,
+          and whichever search ranks higher is used as context.
+          Answers to questions similar enough to a cached one are returned from the cache.
+          The answer is hedged: a duplicate is sent if the first has no token by the hedger's deadline,
+          and only the tokens of the copy that starts first reach on_token.
+        Examples:
+          >>> await chat_query.ask("What is GPT-Engineer?", [])
+          {"question": "What is GPT-Engineer?", "answer": "...", "source_documents": [...]}
+        """
+        if not chat_history:
+            standalone = question
+            embedding = await self.embed(question)
+            cached = self.lookup(embedding)
+            if cached is not None:
+                return cached
+            docs_and_scores = await self.search(embedding)
+        else:
+            speculative = asyncio.create_task(self.retrieve(question))
+            try:
+                standalone = await self.condense(question, chat_history)
+                if standalone == question:
+                    embedding, docs_and_scores = await speculative
+                    cached = self.lookup(embedding)
+                else:
+                    embedding = await self.embed(standalone)
+                    cached = self.lookup(embedding)
+                if cached is not None:
+                    return cached
+
+                if standalone != question:
+                    condensed = await self.search(embedding)
+                    _, docs_and_scores = await speculative
+                    if rank(condensed) >= rank(docs_and_scores):
+                        docs_and_scores = condensed
+            finally:
+                speculative.cancel()
+
+        docs = pack_documents(docs_and_scores, self.token_budget, self.model)
+        log_debug(self.bot, f"Packed {len(docs)} of {len(docs_and_scores)} chunks for: {standalone}")
+        prompt_tokens = (
+            count_tokens(self.qap.template + standalone, self.model)
+            + sum(doc_tokens(doc, self.model) for doc in docs)
+        )
+        tier = self.router.route(standalone, self.channel)
+        doc_chain = self.doc_chain_for(tier)
+
+        async def timed(on_token):
+            started = time.monotonic()
+            answer = await doc_chain.arun(
+                input_documents=docs, question=standalone, callbacks=[TokenStream(on_token)]
+            )
+            self.router.record(tier, time.monotonic() - started)
+            return answer
+
+        answer = await get_hedger(self.bot, "askdb").run(
+            lambda stream, sent: openai_call(
+                self.bot, "askdb", self.group, prompt_tokens, lambda: timed(stream), "answer", on_start=sent
             ),
-            combine_docs_chain=self.doc_chain,
-            return_source_documents=True,
-            question_generator=self.question_generator,
-            verbose=True,
+            on_token,
         )
 
-    def query(self):
+        result = {"question": standalone, "answer": answer, "source_documents": docs}
+        if self.cache is not None:
+            self.cache.store(self.namespace, standalone, embedding, result)
+        return result
+
+    def doc_chain_for(self, tier: str):
         """
-        Returns the ConversationalRetrievalChain object.
+        Gets the answer chain of a model tier.
+        Args:
+          tier (str): "fast" or "strong".
+        Returns:
+          Chain: The streaming stuff chain using the tier's model.
+        Notes:
+          Answers are streamed to the user as they are generated, so they are not escalated.
+        """
+        if tier not in self.doc_chains:
+            llm = ChatOpenAI(
+                streaming=True,
+                model_name=self.router.model(tier),
+                openai_api_key=self.bot.openai_api_key,
+                temperature=0,
+                verbose=self.bot.config.get("langchain_verbose", False),
+                cache=use_cache(self.bot, "answer", 0),
+            )
+            self.doc_chains[tier] = load_qa_chain(llm, chain_type="stuff", prompt=self.qap)
+        return self.doc_chains[tier]
+
+    def lookup(self, embedding: List[float]):
+        """
+        Gets a cached answer to a similar question, if caching is enabled.
+        Args:
+          embedding (list): The embedding of the question.
         Returns:
-          ConversationalRetrievalChain: The ConversationalRetrievalChain object.
+          dict: The cached result, or None.
         """
-        return self.qa
+        if self.cache is None:
+            return None
+        return self.cache.lookup(self.namespace, embedding)
+
+
+_indexes = {}
+
+
+def get_index(bot: "Bot") -> pinecone.Index:
+    """
+    Gets the Pinecone index shared by the whole bot, connecting on first use.
+    Args:
+      bot (Bot): The bot instance.
+    Returns:
+      pinecone.Index: The index, reusing its HTTP connections across queries.
+    """
+    if bot.pinecone_index not in _indexes:
+        pinecone.init(api_key=bot.pinecone_api_key, environment=bot.pinecone_env)
+        _indexes[bot.pinecone_index] = pinecone.Index(bot.pinecone_index)
+    return _indexes[bot.pinecone_index]
+
+
+def close_indexes() -> None:
+    """
+    Closes the connections of every Pinecone index.
+    """
+    for index in _indexes.values():
+        index.close()
+    _indexes.clear()
+
+
+async def openai_call(
+    bot: "Bot",
+    priority: str,
+    group: str,
+    prompt_tokens: int,
+    call: Callable[[], Awaitable[Any]],
+    kind: str = "",
+    on_start: Optional[Callable[[], None]] = None,
+) -> Any:
+    """
+    Makes an OpenAI call within the shared rate limit.
+    Args:
+      bot (Bot): The bot instance.
+      priority (str): The priority class of the call, "chat", "askdb" or "ingest".
+      group (str): The guild the call is made for.
+      prompt_tokens (int): The estimated tokens of the prompt.
+      call (Callable): Starts the call.
+      kind (str): The kind of call, such as "answer" or "summary", whose latencies the breaker's
+        timeout is learned from. Defaults to the priority.
+      on_start (Callable, optional): Called once the rate limit grants the call, just before it is sent.
+    Returns:
+      Any: The result of the call.
+    Raises:
+      CircuitOpenError: If OpenAI has been failing, before any rate limit budget is taken.
+    Notes:
+      The reservation is estimated as the prompt plus openai_completion_estimate tokens, then
+      corrected to the usage OpenAI reports, or to a tiktoken count when streaming hides it.
+      A call answered entirely from the completion cache gives its reservation back, and a call
+      that fails or is cancelled once sent gives back only its completion estimate.
+      Only transport, server, timeout and rate limit errors count against the breaker.
+      A streamed call is held to the breaker's timeout until its first token.
+    """
+    breaker = get_breaker("openai")
+    breaker.check()
+    estimate = prompt_tokens + bot.config.get("openai_completion_estimate", 500)
+    async with get_limiter(bot).limit(priority, estimate, group) as reservation:
+        lookups = []
+        token = cache_lookups.set(lookups)
+        reservation.send(prompt_tokens)
+        if on_start is not None:
+            on_start()
+        try:
+            with get_openai_callback() as usage:
+                result = await breaker.call(call, errors=OPENAI_ERRORS, kind=kind or priority)
+        except CircuitOpenError:
+            reservation.release()
+            raise
+        except Exception:
+            reservation.cancel()
+            raise
+        finally:
+            cache_lookups.reset(token)
+        if lookups and all(lookups):
+            reservation.release()
+            return result
+        used = usage.total_tokens
+        if not used:
+            used = prompt_tokens + (count_tokens(result, bot.openai_model) if isinstance(result, str) else 0)
+        reservation.settle(used)
+    return result
+
+
+def rank(docs_and_scores: List[Tuple[Document, float]], top: int = 3) -> float:
+    """
+    Scores a search result by the mean relevance of its best matches.
+    Args:
+      docs_and_scores (list): Pairs of documents and relevance scores.
+      top (int): The number of best matches to average.
+    Returns:
+      float: The mean score, or 0 for an empty result.
+    Examples:
+      >>> rank([(doc_a, 0.9), (doc_b, 0.7)])
+      0.8
+    """
+    scores = sorted((score for _, score in docs_and_scores), reverse=True)[:top]
+    return sum(scores) / len(scores) if scores else 0.0
@@ -0,0 +1,300 @@
+import asyncio
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+import aiohttp
+import openai.error
+
+from utils.metrics import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+OPENAI_ERRORS = (
+    openai.error.APIConnectionError,
+    openai.error.APIError,
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+    aiohttp.ClientError,
+)
+
+call_progress: ContextVar[Optional[asyncio.Event]] = ContextVar("call_progress", default=None)
+
+
+def report_progress() -> None:
+    """
+    Reports that the call being made through a breaker has started responding, such as with its first token.
+    Notes:
+      From then on the call is no longer held to the adaptive timeout.
+    """
+    progress = call_progress.get()
+    if progress is not None and not progress.is_set():
+        progress.set()
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a dependency whose circuit breaker is open.
+    """
+
+    def __init__(self, name: str, retry_in: float):
+        """
+        Initializes the CircuitOpenError class.
+        Args:
+          name (str): The name of the dependency.
+          retry_in (float): Seconds until the breaker lets a probe call through.
+        """
+        super().__init__(f"{name} is temporarily unavailable, try again in {max(1, round(retry_in))}s.")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Fails fast while a dependency is failing, with timeouts adapted from its observed latency.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        recovery_time: float = 30,
+        default_timeout: float = 30,
+        min_timeout: float = 2,
+        max_timeout: float = 120,
+        timeout_multiplier: float = 2,
+        samples: int = 200,
+    ):
+        """
+        Initializes the CircuitBreaker class.
+        Args:
+          name (str): The name of the dependency.
+          failure_threshold (int): Consecutive failures that open the breaker.
+          recovery_time (float): Seconds the breaker stays open before letting a probe call through.
+          default_timeout (float): The timeout used until enough latencies have been observed.
+          min_timeout (float): The shortest adaptive timeout.
+          max_timeout (float): The longest adaptive timeout.
+          timeout_multiplier (float): How far above the observed p99 latency the timeout is set.
+          samples (int): The number of recent latencies kept per kind of call.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.default_timeout = default_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.latencies = defaultdict(lambda: deque(maxlen=samples))
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def timeout(self, kind: str = "") -> float:
+        """
+        Gets the current timeout of a kind of call.
+        Args:
+          kind (str): The kind of call, such as "embed" or "answer". Each kind learns its own latency.
+        Returns:
+          float: The observed p99 latency times timeout_multiplier, clamped to the timeout range.
+        Examples:
+          >>> breaker.timeout("condense")
+          8.4
+        """
+        latencies = self.latencies.get(kind, ())
+        if len(latencies) < 20:
+            return self.default_timeout
+        values = sorted(latencies)
+        p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+        return min(self.max_timeout, max(self.min_timeout, p99 * self.timeout_multiplier))
+
+    def check(self) -> None:
+        """
+        Fails fast if the breaker is open and not ready to be probed.
+        Raises:
+          CircuitOpenError: If calls are currently refused.
+        """
+        if self.state == CLOSED:
+            return
+        retry_in = self.opened_at + self.recovery_time - time.monotonic()
+        if self.state == OPEN and retry_in <= 0:
+            return
+        metrics.incr(f"breaker_{self.name}_rejected")
+        raise CircuitOpenError(self.name, max(retry_in, 0))
+
+    def before(self) -> None:
+        """
+        Admits a call, turning an open breaker half-open for a single probe once it is due.
+        Raises:
+          CircuitOpenError: If calls are currently refused.
+        """
+        self.check()
+        if self.state == OPEN:
+            self.state = HALF_OPEN
+            self.probing = True
+
+    def success(self, latency: Optional[float], kind: str = "") -> None:
+        """
+        Records a successful call, closing the breaker.
+        Args:
+          latency (float): The call's latency in seconds, or None to leave it out of the adaptive timeout.
+          kind (str): The kind of call.
+        """
+        if latency is not None:
+            self.latencies[kind].append(latency)
+            metrics.observe(f"{self.name}_latency", latency)
+        self.state = CLOSED
+        self.failures = 0
+        self.probing = False
+
+    def failure(self) -> None:
+        """
+        Records a failed call, opening the breaker after too many in a row or a failed probe.
+        """
+        self.failures += 1
+        metrics.incr(f"breaker_{self.name}_failures")
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def abandon(self) -> None:
+        """
+        Forgets a call that was cancelled, letting a new probe through if it was one.
+        """
+        if self.probing:
+            self.state = OPEN
+            self.probing = False
+
+    async def call(
+        self,
+        func: Callable[[], Awaitable[Any]],
+        timeout: Optional[float] = None,
+        errors: Tuple[type, ...] = (Exception,),
+        kind: str = "",
+    ) -> Any:
+        """
+        Makes an async call through the breaker.
+        Args:
+          func (Callable): Starts the call.
+          timeout (float, optional): A fixed timeout, for calls much slower than usual. Defaults to the adaptive timeout.
+          errors (tuple): The exceptions that count as the dependency failing. Others are re-raised as answers.
+          kind (str): The kind of call, whose latencies the adaptive timeout is learned from.
+        Returns:
+          Any: The result of the call.
+        Raises:
+          CircuitOpenError: If the breaker is open.
+          asyncio.TimeoutError: If the call timed out.
+        Notes:
+          A streamed call that calls report_progress is only held to the timeout until then,
+          and its latency is the time to that first response.
+        Examples:
+          >>> await get_breaker("pinecone").call(lambda: asyncio.to_thread(index.query, [embedding], top_k=6))
+        """
+        self.before()
+        started = time.monotonic()
+        progress = asyncio.Event()
+        token = call_progress.set(progress)
+        try:
+            task = asyncio.ensure_future(func())
+        finally:
+            call_progress.reset(token)
+
+        try:
+            latency = await self.first_response(task, progress, timeout or self.timeout(kind), started)
+            result = await task
+        except asyncio.CancelledError:
+            task.cancel()
+            self.abandon()
+            raise
+        except (asyncio.TimeoutError, *errors):
+            self.failure()
+            raise
+        except Exception:
+            self.success(None)
+            raise
+        self.success(None if timeout else latency, kind)
+        return result
+
+    async def first_response(
+        self, task: asyncio.Future, progress: asyncio.Event, timeout: float, started: float
+    ) -> float:
+        """
+        Waits for a call to finish or report progress.
+        Args:
+          task (asyncio.Future): The call.
+          progress (asyncio.Event): Set when the call starts responding.
+          timeout (float): The longest wait.
+          started (float): When the call started, from time.monotonic.
+        Returns:
+          float: The seconds until the call finished or started responding.
+        Raises:
+          asyncio.TimeoutError: If the call did neither in time. The call is cancelled.
+        """
+        waiter = asyncio.ensure_future(progress.wait())
+        try:
+            done, _ = await asyncio.wait({task, waiter}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+        if not done:
+            task.cancel()
+            raise asyncio.TimeoutError()
+        return time.monotonic() - started
+
+    def call_sync(self, func: Callable[[], Any], errors: Tuple[type, ...] = (Exception,)) -> Any:
+        """
+        Makes a blocking call through the breaker. Its timeout is left to the client.
+        Args:
+          func (Callable): Makes the call, within timeout() seconds.
+          errors (tuple): The exceptions that count as the dependency failing. Others are re-raised as answers.
+        Returns:
+          Any: The result of the call.
+        Raises:
+          CircuitOpenError: If the breaker is open.
+        """
+        self.before()
+        started = time.monotonic()
+        try:
+            result = func()
+        except errors:
+            self.failure()
+            raise
+        except Exception:
+            self.success(None)
+            raise
+        self.success(time.monotonic() - started)
+        return result
+
+    def status(self) -> dict:
+        """
+        Gets the breaker's state for display.
+        Returns:
+          dict: The state, consecutive failures, and the current timeout of each kind of call.
+        """
+        timeouts = {kind: round(self.timeout(kind), 2) for kind in self.latencies} or {
+            "": round(self.timeout(), 2)
+        }
+        return {"state": self.state, "failures": self.failures, "timeouts": timeouts}
+
+
+breakers = {
+    "openai": CircuitBreaker("openai", default_timeout=60),
+    "pinecone": CircuitBreaker("pinecone", default_timeout=5, max_timeout=10),
+    "mongo": CircuitBreaker("mongo", default_timeout=10),
+}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """
+    Gets the circuit breaker of a dependency.
+    Args:
+      name (str): "openai", "pinecone" or "mongo".
+    Returns:
+      CircuitBreaker: The shared breaker.
+    """
+    return breakers[name]
@@ -0,0 +1,101 @@
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from utils.metrics import metrics
+
+
+class AnswerCache:
+    """
+    Per-namespace askdb answer cache keyed by question embedding.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl: float = 86400, max_entries: int = 256):
+        """
+        Initializes the AnswerCache class.
+        Args:
+          threshold (float): The cosine similarity above which a cached question matches.
+          ttl (float): Seconds a cached answer stays valid.
+          max_entries (int): The most answers kept per namespace.
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.namespaces = {}
+
+    def lookup(self, namespace: str, embedding: List[float]) -> Optional[dict]:
+        """
+        Gets the cached answer to the most similar question asked of a namespace.
+        Args:
+          namespace (str): The namespace the question was asked of.
+          embedding (list): The embedding of the question.
+        Returns:
+          dict: The cached result, or None on a miss.
+        Examples:
+          >>> cache.lookup('456', embeddings.embed_query("how do I install gpt-engineer"))
+          {"question": "How do I install gpt-engineer?", "answer": "...", "source_documents": [...]}
+        """
+        entries = self.namespaces.get(namespace)
+        if entries:
+            now = time.time()
+            for question in [q for q, entry in entries.items() if now - entry["time"] > self.ttl]:
+                del entries[question]
+
+        if not entries:
+            metrics.incr("askdb_cache_misses")
+            return None
+
+        questions = list(entries)
+        matrix = np.stack([entries[question]["embedding"] for question in questions])
+        similarities = matrix @ normalize(embedding)
+        best = int(np.argmax(similarities))
+
+        if similarities[best] < self.threshold:
+            metrics.incr("askdb_cache_misses")
+            return None
+
+        metrics.incr("askdb_cache_hits")
+        entries.move_to_end(questions[best])
+        return entries[questions[best]]["result"]
+
+    def store(self, namespace: str, question: str, embedding: List[float], result: dict) -> None:
+        """
+        Caches the answer to a question.
+        Args:
+          namespace (str): The namespace the question was asked of.
+          question (str): The question.
+          embedding (list): The embedding of the question.
+          result (dict): The result to return for similar questions.
+        Side Effects:
+          Evicts the least recently used answer of the namespace when it is full.
+        """
+        entries = self.namespaces.setdefault(namespace, OrderedDict())
+        entries[question] = {"embedding": normalize(embedding), "result": result, "time": time.time()}
+        entries.move_to_end(question)
+
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def invalidate(self, namespace: str) -> None:
+        """
+        Drops every cached answer of a namespace, including answers drawn from it together with other namespaces.
+        Args:
+          namespace (str): The namespace whose documents changed.
+        """
+        for key in [key for key in self.namespaces if namespace in key.split(",")]:
+            del self.namespaces[key]
+
+
+def normalize(embedding: List[float]) -> np.ndarray:
+    """
+    Scales an embedding to unit length so a dot product gives cosine similarity.
+    Args:
+      embedding (list): The embedding.
+    Returns:
+      np.ndarray: The unit-length embedding.
+    """
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,148 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
+
+import langchain
+from langchain.cache import RETURN_VAL_TYPE, BaseCache
+from langchain.load.dump import dumps
+from langchain.load.load import loads
+
+from utils.metrics import metrics
+
+if TYPE_CHECKING:
+    from discord_bot.bot import Bot
+
+cache_lookups: ContextVar[Optional[list]] = ContextVar("cache_lookups", default=None)
+
+
+class CompletionCache(BaseCache):
+    """
+    Size-capped on-disk cache of LLM completions, keyed by a hash of the model, parameters and prompt.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = 50_000_000):
+        """
+        Initializes the CompletionCache class.
+        Args:
+          path (Path): The SQLite file of the cache.
+          max_bytes (int): The most bytes of completions kept. The least recently used are evicted first.
+        """
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS completions "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS completions_used ON completions (used)")
+        self.size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        """
+        Gets the cached completion of a prompt.
+        Args:
+          prompt (str): The prompt, serialized by langchain.
+          llm_string (str): The model and its parameters, serialized by langchain.
+        Returns:
+          list: The cached generations, or None on a miss.
+        Side Effects:
+          Appends whether it was a hit to the list in cache_lookups, if one is set.
+        """
+        key = cache_key(prompt, llm_string)
+        lookups = cache_lookups.get()
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM completions WHERE key = ?", (key,)).fetchone()
+            if lookups is not None:
+                lookups.append(row is not None)
+            if row is None:
+                metrics.incr("completion_cache_misses")
+                return None
+            self.connection.execute("UPDATE completions SET used = ? WHERE key = ?", (time.time(), key))
+        metrics.incr("completion_cache_hits")
+        return loads(row[0])
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        """
+        Caches the completion of a prompt.
+        Args:
+          prompt (str): The prompt, serialized by langchain.
+          llm_string (str): The model and its parameters, serialized by langchain.
+          return_val (list): The generations to cache.
+        Side Effects:
+          Evicts the least recently used completions while the cache is over max_bytes.
+        """
+        key = cache_key(prompt, llm_string)
+        value = dumps(return_val)
+        with self.lock:
+            old = self.connection.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO completions (key, value, size, used) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()),
+            )
+            self.size += len(value) - (old[0] if old else 0)
+            while self.size > self.max_bytes:
+                rows = self.connection.execute(
+                    "SELECT key, size FROM completions ORDER BY used LIMIT 64"
+                ).fetchall()
+                if not rows:
+                    break
+                evicted = []
+                for evicted_key, size in rows:
+                    if self.size <= self.max_bytes:
+                        break
+                    evicted.append((evicted_key,))
+                    self.size -= size
+                self.connection.executemany("DELETE FROM completions WHERE key = ?", evicted)
+            metrics.set("completion_cache_bytes", self.size)
+
+    def clear(self, **kwargs: Any) -> None:
+        """
+        Drops every cached completion.
+        """
+        with self.lock:
+            self.connection.execute("DELETE FROM completions")
+            self.size = 0
+
+
+def cache_key(prompt: str, llm_string: str) -> str:
+    """
+    Hashes a prompt and the model that completes it.
+    Args:
+      prompt (str): The prompt, serialized by langchain.
+      llm_string (str): The model and its parameters, serialized by langchain.
+    Returns:
+      str: The hex SHA-256 of both.
+    """
+    return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+def use_cache(bot: "Bot", chain: str, temperature: float) -> bool:
+    """
+    Decides whether an LLM may use the completion cache, setting the cache up on first use.
+    Args:
+      bot (Bot): The bot instance.
+      chain (str): The chain the LLM belongs to: "chat", "summary", "condense" or "answer".
+      temperature (float): The temperature of the LLM.
+    Returns:
+      bool: True when the cache is enabled, enabled for the chain, and the LLM is deterministic.
+    Notes:
+      The cache is off unless completion_cache is set. completion_cache_chains lists the
+      chains that use it, and defaults to every chain.
+    Examples:
+      >>> ChatOpenAI(temperature=0, cache=use_cache(bot, "condense", 0))
+    """
+    if not bot.config.get("completion_cache", False) or temperature != 0:
+        return False
+    if chain not in bot.config.get("completion_cache_chains", ["chat", "summary", "condense", "answer"]):
+        return False
+    if not isinstance(langchain.llm_cache, CompletionCache):
+        langchain.llm_cache = CompletionCache(
+            bot.paths["data"] / "completion_cache.sqlite",
+            max_bytes=bot.config.get("completion_cache_bytes", 50_000_000),
+        )
+    return True
@@ -0,0 +1,142 @@
+from functools import lru_cache
+from typing import List, Tuple
+
+import tiktoken
+from langchain.docstore.document import Document
+
+DEFAULT_ENCODING = "cl100k_base"
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 400
+
+
+@lru_cache(maxsize=8)
+def get_encoding(model: str = ""):
+    """
+    Gets the tiktoken encoding for a model.
+    Args:
+      model (str): The model name.
+    Returns:
+      tiktoken.Encoding: The encoding for the model, or cl100k_base if the model is unknown.
+    Examples:
+      >>> get_encoding("gpt-3.5-turbo-16k").name
+      'cl100k_base'
+    """
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def count_tokens(text: str, model: str = "") -> int:
+    """
+    Counts the tokens in a string.
+    Args:
+      text (str): The text to count.
+      model (str): The model whose encoding is used.
+    Returns:
+      int: The number of tokens in the text.
+    Examples:
+      >>> count_tokens("Hello world!")
+      3
+    """
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+
+def doc_tokens(doc: Document, model: str = "") -> int:
+    """
+    Gets the token count of a document, preferring the count cached at ingest time.
+    Args:
+      doc (Document): The document.
+      model (str): The model whose encoding is used.
+    Returns:
+      int: The number of tokens in the document's page content.
+    """
+    tokens = doc.metadata.get("tokens")
+    if isinstance(tokens, (int, float)) and tokens > 0:
+        return int(tokens)
+    return count_tokens(doc.page_content, model)
+
+
+def find_overlap(head: str, tail: str) -> int:
+    """
+    Finds how many characters at the end of one chunk are repeated at the start of the next.
+    Args:
+      head (str): The earlier chunk.
+      tail (str): The later chunk.
+    Returns:
+      int: The length of the overlap, or 0 if it is shorter than MIN_OVERLAP_CHARS.
+    Examples:
+      >>> find_overlap("the quick brown fox jumps over", "brown fox jumps over the lazy dog")
+      20
+    """
+    longest = min(len(head), len(tail), MAX_OVERLAP_CHARS)
+    for size in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+        if head.endswith(tail[:size]):
+            return size
+    return 0
+
+
+def trim_overlap(doc: Document, selected: List[Document]) -> Document:
+    """
+    Removes text a document shares with already selected chunks from the same source.
+    Args:
+      doc (Document): The candidate document.
+      selected (list): The documents already packed into the context.
+    Returns:
+      Document: The document, with overlapping text removed if any was found.
+    Notes:
+      Ingest splits with a character overlap, so neighbouring chunks repeat text at their edges.
+    """
+    source = doc.metadata.get("source")
+    text = doc.page_content
+    trimmed = False
+
+    for other in selected:
+        if other.metadata.get("source") != source:
+            continue
+        before = find_overlap(other.page_content, text)
+        if before:
+            text = text[before:]
+            trimmed = True
+        after = find_overlap(text, other.page_content)
+        if after:
+            text = text[:-after]
+            trimmed = True
+
+    if not trimmed:
+        return doc
+
+    metadata = {k: v for k, v in doc.metadata.items() if k != "tokens"}
+    return Document(page_content=text, metadata=metadata)
+
+
+def pack_documents(
+    docs_and_scores: List[Tuple[Document, float]], budget: int, model: str = ""
+) -> List[Document]:
+    """
+    Greedily packs the most relevant documents into a token budget.
+    Args:
+      docs_and_scores (list): Pairs of documents and relevance scores, higher is better.
+      budget (int): The maximum number of context tokens.
+      model (str): The model whose encoding is used.
+    Returns:
+      list: The packed documents, most relevant first.
+    Examples:
+      >>> pack_documents(vectorstore.similarity_search_with_score("What is GPT-Engineer?", k=12), 3000)
+      [Document(page_content='...', metadata={...}), ...]
+    """
+    ranked = sorted(docs_and_scores, key=lambda pair: pair[1], reverse=True)
+    packed = []
+    remaining = budget
+
+    for doc, _ in ranked:
+        doc = trim_overlap(doc, packed)
+        if not doc.page_content.strip():
+            continue
+        tokens = doc_tokens(doc, model)
+        if tokens > remaining:
+            continue
+        packed.append(doc)
+        remaining -= tokens
+
+    return packed
@@ -0,0 +1,142 @@
+import asyncio
+from typing import TYPE_CHECKING, List, Optional
+
+from langchain.embeddings.openai import OpenAIEmbeddings
+
+from utils.breaker import OPENAI_ERRORS, get_breaker
+from utils.context import count_tokens
+from utils.metrics import metrics
+from utils.ratelimit import RateLimiter, get_limiter
+
+if TYPE_CHECKING:
+    from discord_bot.bot import Bot
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent embedding requests into batched API calls.
+    """
+
+    def __init__(
+        self,
+        embeddings: OpenAIEmbeddings,
+        max_batch: int = 16,
+        max_wait: float = 0.01,
+        limiter: Optional[RateLimiter] = None,
+    ):
+        """
+        Initializes the EmbeddingBatcher class.
+        Args:
+          embeddings (OpenAIEmbeddings): The embeddings client.
+          max_batch (int): The most texts sent in one API call.
+          max_wait (float): Seconds a request waits for others to join its batch.
+          limiter (RateLimiter, optional): The rate limit batches are sent within, as askdb work.
+        """
+        self.embeddings = embeddings
+        self.limiter = limiter
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = []
+        self.timer = None
+        self.tasks = set()
+
+    async def embed(self, text: str) -> List[float]:
+        """
+        Embeds a text, batched with any other texts requested at about the same time.
+        Args:
+          text (str): The text to embed.
+        Returns:
+          list: The embedding of the text.
+        Examples:
+          >>> await batcher.embed("What is GPT-Engineer?")
+          [0.0023, -0.0091, ...]
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((text, future))
+
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_wait, self.flush)
+
+        return await future
+
+    def flush(self) -> None:
+        """
+        Sends every pending request, in batches of at most max_batch texts.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        while self.pending:
+            batch = self.pending[: self.max_batch]
+            self.pending = self.pending[self.max_batch :]
+            task = asyncio.create_task(self._send(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _send(self, batch: list) -> None:
+        """
+        Embeds a batch of texts and hands each waiting request its result.
+        Args:
+          batch (list): The (text, future) pairs to embed.
+        """
+        batch = [(text, future) for text, future in batch if not future.done()]
+        if not batch:
+            return
+
+        metrics.observe("embedding_batch_size", len(batch))
+        texts = [text for text, _ in batch]
+        breaker = get_breaker("openai")
+        try:
+            if self.limiter is None:
+                vectors = await breaker.call(
+                    lambda: asyncio.to_thread(self.embeddings.embed_documents, texts),
+                    errors=OPENAI_ERRORS,
+                    kind="embed",
+                )
+            else:
+                breaker.check()
+                tokens = sum(count_tokens(text) for text in texts)
+                async with self.limiter.limit("askdb", tokens) as reservation:
+                    reservation.send(tokens)
+                    vectors = await breaker.call(
+                        lambda: asyncio.to_thread(self.embeddings.embed_documents, texts),
+                        errors=OPENAI_ERRORS,
+                        kind="embed",
+                    )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+
+_batchers = {}
+
+
+def get_embedder(bot: "Bot") -> EmbeddingBatcher:
+    """
+    Gets the embedding batcher shared by the whole bot.
+    Args:
+      bot (Bot): The bot instance.
+    Returns:
+      EmbeddingBatcher: The shared batcher for the bot's OpenAI key.
+    """
+    if bot.openai_api_key not in _batchers:
+        embeddings = OpenAIEmbeddings(
+            model="text-embedding-ada-002", openai_api_key=bot.openai_api_key
+        )
+        _batchers[bot.openai_api_key] = EmbeddingBatcher(
+            embeddings,
+            max_batch=bot.config.get("embedding_batch_size", 16),
+            max_wait=bot.config.get("embedding_batch_wait", 0.01),
+            limiter=get_limiter(bot),
+        )
+    return _batchers[bot.openai_api_key]
@@ -0,0 +1,295 @@
+import asyncio
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Awaitable, Callable, List, Optional, TypeVar
+
+from utils.metrics import metrics
+
+if TYPE_CHECKING:
+    from discord_bot.bot import Bot
+
+T = TypeVar("T")
+
+
+class Attempt:
+    """
+    One of the racing copies of a hedged request, holding back its tokens until it wins.
+    """
+
+    def __init__(self, start: Callable[..., Awaitable[T]], signal: asyncio.Event):
+        """
+        Initializes the Attempt class.
+        Args:
+          start (Callable): Starts the request, given the function its tokens are passed to and the
+            function called once it is sent.
+          signal (asyncio.Event): Set when the attempt produces its first token or finishes.
+        """
+        self.signal = signal
+        self.started = None
+        self.sent = asyncio.Event()
+        self.first_token = None
+        self.tokens = []
+        self.on_token = None
+        self.task = asyncio.create_task(self.run(start))
+
+    async def run(self, start: Callable[..., Awaitable[T]]) -> T:
+        """
+        Runs the request, signalling when it ends.
+        Args:
+          start (Callable): Starts the request.
+        Returns:
+          Any: The result of the request.
+        """
+        try:
+            result = await start(self.token, self.send)
+            if self.first_token is None:
+                self.first_token = time.monotonic()
+            return result
+        finally:
+            self.sent.set()
+            self.signal.set()
+
+    def send(self) -> None:
+        """
+        Starts the attempt's clock, once the request is sent rather than queued for the rate limit.
+        """
+        if self.started is None:
+            self.started = time.monotonic()
+        self.sent.set()
+
+    def token(self, token: str) -> None:
+        """
+        Takes a token of the response, passing it on once the attempt has won.
+        Args:
+          token (str): The token.
+        """
+        if self.first_token is None:
+            self.first_token = time.monotonic()
+            self.signal.set()
+        if self.on_token is not None:
+            self.on_token(token)
+        else:
+            self.tokens.append(token)
+
+    def forward(self, on_token: Optional[Callable[[str], None]]) -> None:
+        """
+        Passes the held back tokens on, and every later token as it arrives.
+        Args:
+          on_token (Callable, optional): Called with every token of the response.
+        """
+        tokens, self.tokens = self.tokens, []
+        self.on_token = on_token or (lambda token: None)
+        for token in tokens:
+            self.on_token(token)
+
+    def drop(self) -> None:
+        """
+        Discards the attempt's response, cancelling it as soon as its first token arrives.
+        Notes:
+          The prompt is paid for once it is sent, so waiting for the first token costs little,
+          and tells how long the request would have taken without hedging.
+        """
+        self.tokens = []
+        self.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        if self.first_token is not None:
+            self.task.cancel()
+        else:
+            self.on_token = lambda token: self.task.cancel()
+
+    def failed(self) -> bool:
+        """
+        Checks whether the attempt ended without a response.
+        Returns:
+          bool: True if the request raised or was cancelled.
+        """
+        return self.task.done() and (self.task.cancelled() or self.task.exception() is not None)
+
+
+class Hedger:
+    """
+    Sends a duplicate of a slow streaming request, keeping whichever copy starts responding first.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        enabled: bool = False,
+        percentile: float = 95,
+        default_deadline: float = 4,
+        min_deadline: float = 0.5,
+        budget: float = 0.05,
+        burst: float = 2,
+        samples: int = 200,
+    ):
+        """
+        Initializes the Hedger class.
+        Args:
+          name (str): The prefix of the metrics recorded for the requests.
+          enabled (bool): Whether to hedge at all. When off, requests run once, as before.
+          percentile (float): The percentile of first token latency after which a duplicate is sent.
+          default_deadline (float): The deadline used until enough latencies have been observed.
+          min_deadline (float): The shortest deadline.
+          budget (float): The most duplicates sent per request, on average.
+          burst (float): The most duplicates that may be sent back to back.
+          samples (int): The number of recent first token latencies kept.
+        """
+        self.name = name
+        self.enabled = enabled
+        self.percentile = percentile
+        self.default_deadline = default_deadline
+        self.min_deadline = min_deadline
+        self.budget = budget
+        self.burst = burst
+        self.credit = burst
+        self.latencies = deque(maxlen=samples)
+
+    def deadline(self) -> float:
+        """
+        Gets how long a request may go without a first token before it is hedged.
+        Returns:
+          float: The observed percentile of first token latency, no shorter than min_deadline.
+        Examples:
+          >>> hedger.deadline()
+          2.7
+        """
+        if len(self.latencies) < 20:
+            return self.default_deadline
+        values = sorted(self.latencies)
+        index = min(len(values) - 1, int(len(values) * self.percentile / 100))
+        return max(self.min_deadline, values[index])
+
+    def spend(self) -> bool:
+        """
+        Takes the credit for a duplicate request from the hedge budget.
+        Returns:
+          bool: True if the budget allows another duplicate.
+        """
+        if self.credit < 1:
+            metrics.incr(f"{self.name}_hedges_capped")
+            return False
+        self.credit -= 1
+        return True
+
+    async def run(
+        self,
+        start: Callable[..., Awaitable[T]],
+        on_token: Optional[Callable[[str], None]] = None,
+    ) -> T:
+        """
+        Runs a streaming request, sending a duplicate if it has no first token by the deadline.
+        Args:
+          start (Callable): Starts a copy of the request, given the function its tokens are passed to
+            and the function to call once it is sent.
+          on_token (Callable, optional): Called with every token of the winning copy.
+        Returns:
+          Any: The result of the copy that produced a first token first. The other copy is cancelled.
+        Raises:
+          Exception: The error of the first copy, if no copy succeeds.
+        Notes:
+          {name}_first_token and {name}_first_token_unhedged record the latency to a first token with
+          and without hedging, and the {name}_hedge_p99_saved gauge the difference of their p99s.
+          When the duplicate wins, the first copy runs on until its own first token to measure it.
+          The deadline and latencies are measured from when the first copy is sent, so time spent
+          waiting for the rate limit neither triggers a duplicate nor counts as latency.
+        Examples:
+          >>> await hedger.run(
+          ...     lambda on_token, on_send: openai_call(
+          ...         ..., lambda: chain.arun(callbacks=[TokenStream(on_token)]), on_start=on_send
+          ...     )
+          ... )
+        """
+        if not self.enabled:
+            return await start(on_token or (lambda token: None), lambda: None)
+
+        self.credit = min(self.burst, self.credit + self.budget)
+        signal = asyncio.Event()
+        attempts = [Attempt(start, signal)]
+        try:
+            await attempts[0].sent.wait()
+            try:
+                await asyncio.wait_for(signal.wait(), self.deadline())
+            except asyncio.TimeoutError:
+                if self.spend():
+                    metrics.incr(f"{self.name}_hedges")
+                    attempts.append(Attempt(start, signal))
+
+            winner = self.winner(attempts)
+            while winner is None:
+                signal.clear()
+                await signal.wait()
+                winner = self.winner(attempts)
+        except BaseException:
+            for attempt in attempts:
+                attempt.task.cancel()
+            raise
+
+        primary = attempts[0]
+        if winner is primary:
+            for attempt in attempts[1:]:
+                attempt.task.cancel()
+            if winner.failed():
+                return await winner.task
+            metrics.observe(f"{self.name}_first_token", winner.first_token - primary.started)
+            self.record(primary)
+        else:
+            metrics.incr(f"{self.name}_hedge_wins")
+            metrics.observe(f"{self.name}_first_token", winner.first_token - primary.started)
+            primary.drop()
+            primary.task.add_done_callback(lambda _: self.record(primary))
+        winner.forward(on_token)
+        return await winner.task
+
+    def winner(self, attempts: List[Attempt]) -> Optional[Attempt]:
+        """
+        Picks the copy that responded first.
+        Args:
+          attempts (list): The copies of the request.
+        Returns:
+          Attempt: The copy with the earliest first token, the first copy if every copy failed, or None while undecided.
+        """
+        responded = [attempt for attempt in attempts if attempt.first_token is not None]
+        if responded:
+            return min(responded, key=lambda attempt: attempt.first_token)
+        if all(attempt.failed() for attempt in attempts):
+            return attempts[0]
+        return None
+
+    def record(self, primary: Attempt) -> None:
+        """
+        Records the latency to a first token the request would have had without hedging.
+        Args:
+          primary (Attempt): The first copy of the request.
+        Side Effects:
+          Updates the {name}_hedge_p99_saved gauge.
+        """
+        unhedged = (primary.first_token or time.monotonic()) - primary.started
+        self.latencies.append(unhedged)
+        metrics.observe(f"{self.name}_first_token_unhedged", unhedged)
+
+        before = metrics.percentile(f"{self.name}_first_token_unhedged", 99)
+        after = metrics.percentile(f"{self.name}_first_token", 99)
+        metrics.set(f"{self.name}_hedge_p99_saved", round(before - after, 3))
+
+
+_hedgers = {}
+
+
+def get_hedger(bot: "Bot", name: str) -> Hedger:
+    """
+    Gets the hedger of a kind of request, shared by the whole bot.
+    Args:
+      bot (Bot): The bot instance.
+      name (str): The kind of request, "chat" or "askdb".
+    Returns:
+      Hedger: The hedger, enabled by the hedging config.
+    """
+    key = (bot.openai_api_key, name)
+    if key not in _hedgers:
+        _hedgers[key] = Hedger(
+            name,
+            enabled=bot.config.get("hedging", False),
+            percentile=bot.config.get("hedge_percentile", 95),
+            default_deadline=bot.config.get("hedge_default_deadline", 4),
+            budget=bot.config.get("hedge_budget", 0.05),
+        )
+    return _hedgers[key]
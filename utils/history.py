@@ -0,0 +1,167 @@
+import time
+from collections import OrderedDict, deque
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from utils.breaker import CircuitOpenError
+from utils.context import count_tokens
+
+if TYPE_CHECKING:
+    from utils.mongo_db import MongoDBHandler
+
+
+class ConversationHistory:
+    """
+    Bounded per-(user, db_id) askdb conversation history.
+    """
+
+    def __init__(
+        self,
+        max_turns: int = 5,
+        max_tokens: int = 1000,
+        ttl: float = 1800,
+        max_conversations: int = 1000,
+        handler: Optional["MongoDBHandler"] = None,
+        model: str = "",
+    ):
+        """
+        Initializes the ConversationHistory class.
+        Args:
+          max_turns (int): The most (question, answer) turns kept per conversation.
+          max_tokens (int): The most tokens kept per conversation.
+          ttl (float): Seconds of inactivity after which a conversation expires.
+          max_conversations (int): The most conversations kept in memory.
+          handler (MongoDBHandler, optional): Store that evicted conversations spill to.
+          model (str): The model whose encoding is used to count tokens.
+        """
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.ttl = ttl
+        self.max_conversations = max_conversations
+        self.handler = handler
+        self.model = model
+        self.conversations = OrderedDict()
+
+    def get(self, user_id: str, db_id: str) -> List[Tuple[str, str]]:
+        """
+        Gets the chat history of a conversation.
+        Args:
+          user_id (str): The ID of the user.
+          db_id (str): The ID of the DB.
+        Returns:
+          list: The (question, answer) pairs, oldest first.
+        Examples:
+          >>> history.get('123', '456')
+          [('What is GPT-Engineer?', 'GPT-Engineer is ...')]
+        """
+        conversation = self._load((user_id, db_id))
+        if conversation is None:
+            return []
+        return [(question, answer) for question, answer, _ in conversation["turns"]]
+
+    def append(self, user_id: str, db_id: str, question: str, answer: str) -> None:
+        """
+        Adds a turn to a conversation.
+        Args:
+          user_id (str): The ID of the user.
+          db_id (str): The ID of the DB.
+          question (str): The question asked.
+          answer (str): The answer given.
+        Side Effects:
+          Drops the oldest turns over the turn or token cap, and evicts the least recently used conversation when full.
+        """
+        key = (user_id, db_id)
+        conversation = self._load(key)
+        if conversation is None:
+            conversation = {"turns": deque(maxlen=self.max_turns), "tokens": 0}
+            self.conversations[key] = conversation
+
+        turns = conversation["turns"]
+        if len(turns) == turns.maxlen:
+            conversation["tokens"] -= turns[0][2]
+
+        tokens = count_tokens(question, self.model) + count_tokens(answer, self.model)
+        turns.append((question, answer, tokens))
+        conversation["tokens"] += tokens
+        conversation["updated"] = time.time()
+
+        while turns and conversation["tokens"] > self.max_tokens:
+            conversation["tokens"] -= turns.popleft()[2]
+
+        self._evict()
+
+    def clear(self, db_id: str, user_id: Optional[str] = None) -> None:
+        """
+        Forgets the in-memory conversations about a DB, alone or together with other DBs.
+        Args:
+          db_id (str): The ID of the DB.
+          user_id (str, optional): Only forget this user's conversations. Defaults to every user's.
+        """
+        for key in [
+            key
+            for key in self.conversations
+            if db_id in key[1].split(",") and (user_id is None or key[0] == user_id)
+        ]:
+            del self.conversations[key]
+
+    def _load(self, key: Tuple[str, str]) -> Optional[dict]:
+        """
+        Gets a live conversation from memory, or from the spill store on a miss.
+        Args:
+          key (tuple): The (user_id, db_id) key.
+        Returns:
+          dict: The conversation, or None if there is none or it has expired.
+        """
+        conversation = self.conversations.get(key)
+
+        if conversation is None and self.handler is not None:
+            try:
+                stored = self.handler.pop_history(*key)
+            except CircuitOpenError:
+                stored = None
+            if stored:
+                conversation = {
+                    "turns": deque((tuple(turn) for turn in stored["turns"]), maxlen=self.max_turns),
+                    "tokens": sum(turn[2] for turn in stored["turns"][-self.max_turns:]),
+                    "updated": stored["updated"],
+                }
+                self.conversations[key] = conversation
+                self._evict()
+
+        if conversation is None:
+            return None
+
+        if time.time() - conversation["updated"] > self.ttl:
+            del self.conversations[key]
+            return None
+
+        self.conversations.move_to_end(key)
+        return conversation
+
+    def _evict(self) -> None:
+        """
+        Evicts the least recently used conversations until the memory cap is met.
+        """
+        while len(self.conversations) > self.max_conversations:
+            evicted_key, evicted = self.conversations.popitem(last=False)
+            self._spill(evicted_key, evicted)
+
+    def _spill(self, key: Tuple[str, str], conversation: dict) -> None:
+        """
+        Writes an evicted conversation to the spill store, if one is set and the conversation is live.
+        Args:
+          key (tuple): The (user_id, db_id) key.
+          conversation (dict): The evicted conversation.
+        Notes:
+          The conversation is dropped while the mongo circuit breaker is open.
+        """
+        if self.handler is None or time.time() - conversation["updated"] > self.ttl:
+            return
+        try:
+            self.handler.save_history(
+                *key,
+                turns=[list(turn) for turn in conversation["turns"]],
+                updated=conversation["updated"],
+                ttl=self.ttl,
+            )
+        except CircuitOpenError:
+            pass
@@ -1,22 +1,45 @@
 import asyncio
 import os
 import tempfile
+import uuid
 from typing import TYPE_CHECKING
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse, urlunparse
 
 import aiohttp
-import pinecone
 from bs4 import BeautifulSoup
 from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.vectorstores import Pinecone
 
 from discord_bot.logger import log_debug, log_error, log_info
+from utils.ai import get_index
+from utils.breaker import OPENAI_ERRORS, get_breaker
+from utils.context import count_tokens
+from utils.ratelimit import get_limiter
 
 if TYPE_CHECKING:
     from discord_bot.bot import Bot
 
 
+def normalize_url(url: str) -> str:
+    """
+    Normalizes a URL so that different spellings of the same docs site compare equal.
+    Args:
+      url (str): The URL to normalize.
+    Returns:
+      str: The URL with a lowercase scheme and host, and no fragment or trailing slash.
+    Examples:
+      >>> normalize_url('HTTPS://GPT-Engineer.readthedocs.io/en/latest/#intro')
+      'https://gpt-engineer.readthedocs.io/en/latest'
+    """
+    parsed = urlparse(url.strip())
+    path = parsed.path.rstrip("/")
+    if path.endswith("/index.html"):
+        path = path[: -len("/index.html")]
+    return urlunparse(
+        (parsed.scheme.lower() or "https", parsed.netloc.lower(), path, "", parsed.query, "")
+    )
+
+
 async def download_file(bot: "Bot", session: aiohttp.ClientSession, url: str, output_directory: str):
     """
     Downloads a file from a given URL.
@@ -50,6 +73,9 @@ async def ingest(bot: "Bot", url: str, namespace: str):
       namespace (str): The namespace to ingest the documents into.
     Side Effects:
       Ingests documents into Pinecone.
+    Notes:
+      Embedding and upserting go through the openai and pinecone circuit breakers,
+      each call within ingest_call_timeout seconds.
     Examples:
       >>> ingest_db(bot, 'https://example.com/db', 'my_namespace')
     """
@@ -120,13 +146,41 @@ async def ingest(bot: "Bot", url: str, namespace: str):
         )
         texts = text_splitter.split_documents(db)
 
-        pinecone.init(api_key=bot.pinecone_api_key, environment=bot.pinecone_env)
+        for text in texts:
+            text.metadata["tokens"] = count_tokens(text.page_content, bot.openai_model)
+
         embeddings = OpenAIEmbeddings(
             model="text-embedding-ada-002", openai_api_key=bot.openai_api_key
         )
-        Pinecone.from_documents(
-            texts, embeddings, index_name=bot.pinecone_index, namespace=namespace
-        )
+        index = get_index(bot)
+        limiter = get_limiter(bot)
+        openai_breaker = get_breaker("openai")
+        pinecone_breaker = get_breaker("pinecone")
+        batch_size = bot.config.get("ingest_batch_size", 32)
+        call_timeout = bot.config.get("ingest_call_timeout", 120)
+
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start : start + batch_size]
+            contents = [text.page_content for text in batch]
+            tokens = sum(text.metadata["tokens"] for text in batch)
+            openai_breaker.check()
+            async with limiter.limit("ingest", tokens) as reservation:
+                reservation.send(tokens)
+                vectors = await openai_breaker.call(
+                    lambda: asyncio.to_thread(embeddings.embed_documents, contents),
+                    timeout=call_timeout,
+                    errors=OPENAI_ERRORS,
+                    kind="embed",
+                )
+
+            records = [
+                (str(uuid.uuid4()), vector, {**text.metadata, "text": text.page_content})
+                for text, vector in zip(batch, vectors)
+            ]
+            await pinecone_breaker.call(
+                lambda: asyncio.to_thread(index.upsert, vectors=records, namespace=namespace),
+                timeout=call_timeout,
+            )
         log_debug(
             bot,
             f"Successfully ingested {len(texts)} documents into Pinecone index {bot.pinecone_index} in namespace {namespace}.",
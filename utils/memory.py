@@ -0,0 +1,151 @@
+import json
+import zlib
+from typing import Any, Dict, List
+
+from langchain import LLMChain
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.schema import (AIMessage, BaseMessage, HumanMessage,
+                              SystemMessage, get_buffer_string)
+from pydantic import Field
+
+from utils.context import count_tokens
+
+
+class TokenBudgetMemory(BaseChatMemory):
+    """
+    Chat memory that keeps recent messages verbatim within a token budget, and older ones as a rolling summary.
+    """
+
+    memory_key: str = "history"
+    max_tokens: int = 1000
+    model: str = ""
+    summary: str = ""
+    summary_tokens: int = 0
+    token_counts: List[int] = Field(default_factory=list)
+    buffer_tokens: int = 0
+    pending: List[BaseMessage] = Field(default_factory=list)
+
+    @property
+    def memory_variables(self) -> List[str]:
+        """
+        Gets the variables the memory fills in.
+        Returns:
+          list: The memory key.
+        """
+        return [self.memory_key]
+
+    @property
+    def tokens(self) -> int:
+        """
+        Gets the tokens the memory adds to a prompt.
+        Returns:
+          int: The tokens of the summary and the verbatim messages.
+        """
+        return self.summary_tokens + self.buffer_tokens
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Gets the summary and the verbatim messages.
+        Args:
+          inputs (dict): The inputs of the chain.
+        Returns:
+          dict: The messages, or their text when return_messages is off, under the memory key.
+        """
+        messages = list(self.chat_memory.messages)
+        if self.summary:
+            messages.insert(0, SystemMessage(content=f"Summary of the earlier conversation: {self.summary}"))
+        if self.return_messages:
+            return {self.memory_key: messages}
+        return {self.memory_key: get_buffer_string(messages)}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        """
+        Adds an exchange, moving the oldest exchanges out of the verbatim budget.
+        Args:
+          inputs (dict): The inputs of the chain.
+          outputs (dict): The outputs of the chain.
+        Side Effects:
+          Exchanges over max_tokens wait in pending until asummarize folds them into the summary.
+          The most recent exchange is always kept verbatim, even when it alone is over max_tokens.
+        """
+        super().save_context(inputs, outputs)
+        for message in self.chat_memory.messages[len(self.token_counts):]:
+            tokens = count_tokens(message.content, self.model)
+            self.token_counts.append(tokens)
+            self.buffer_tokens += tokens
+
+        messages = self.chat_memory.messages
+        while self.buffer_tokens > self.max_tokens and len(messages) > 2:
+            for _ in range(2):
+                self.pending.append(messages.pop(0))
+                self.buffer_tokens -= self.token_counts.pop(0)
+
+    async def asummarize(self, chain: LLMChain) -> str:
+        """
+        Folds the pending messages into the summary.
+        Args:
+          chain (LLMChain): A chain taking the current summary and the new lines of conversation.
+        Returns:
+          str: The new summary.
+        Notes:
+          Messages moved out while the summary is being generated stay pending for the next call.
+        """
+        folded = len(self.pending)
+        if not folded:
+            return self.summary
+        new_lines = get_buffer_string(self.pending[:folded])
+        summary = (await chain.apredict(summary=self.summary, new_lines=new_lines)).strip()
+
+        self.summary = summary
+        self.summary_tokens = count_tokens(summary, self.model)
+        del self.pending[:folded]
+        return summary
+
+    def clear(self) -> None:
+        """
+        Forgets the whole conversation.
+        """
+        super().clear()
+        self.summary = ""
+        self.summary_tokens = 0
+        self.token_counts = []
+        self.buffer_tokens = 0
+        self.pending = []
+
+    def dumps(self) -> bytes:
+        """
+        Serializes the conversation compactly.
+        Returns:
+          bytes: The zlib compressed JSON of the summary and messages, with their token counts.
+        """
+        data = {
+            "summary": self.summary,
+            "summary_tokens": self.summary_tokens,
+            "messages": [
+                [message.type == "human", message.content, tokens]
+                for message, tokens in zip(self.chat_memory.messages, self.token_counts)
+            ],
+            "pending": [[message.type == "human", message.content] for message in self.pending],
+        }
+        return zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+    def loads(self, blob: bytes) -> None:
+        """
+        Restores a conversation serialized by dumps.
+        Args:
+          blob (bytes): The serialized conversation.
+        Side Effects:
+          Replaces the current conversation.
+        """
+        data = json.loads(zlib.decompress(blob).decode("utf-8"))
+        self.clear()
+        self.summary = data["summary"]
+        self.summary_tokens = data["summary_tokens"]
+        for human, content, tokens in data["messages"]:
+            self.chat_memory.messages.append(HumanMessage(content=content) if human else AIMessage(content=content))
+            self.token_counts.append(tokens)
+            self.buffer_tokens += tokens
+        self.pending = [
+            HumanMessage(content=content) if human else AIMessage(content=content)
+            for human, content in data["pending"]
+        ]
@@ -0,0 +1,83 @@
+from collections import defaultdict, deque
+from typing import Optional
+
+
+class Metrics:
+    """
+    In-process counters, gauges and latency samples for the bot.
+    """
+
+    def __init__(self, samples: int = 1000):
+        """
+        Initializes the Metrics class.
+        Args:
+          samples (int): The number of recent samples kept per observed metric.
+        """
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.samples = defaultdict(lambda: deque(maxlen=samples))
+
+    def incr(self, name: str, value: int = 1) -> None:
+        """
+        Increments a counter.
+        Args:
+          name (str): The name of the counter.
+          value (int): The amount to add.
+        Examples:
+          >>> metrics.incr("askdb_cache_hits")
+        """
+        self.counters[name] += value
+
+    def set(self, name: str, value: float) -> None:
+        """
+        Sets a gauge.
+        Args:
+          name (str): The name of the gauge.
+          value (float): The current value.
+        """
+        self.gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        """
+        Records a sample, such as a latency in seconds.
+        Args:
+          name (str): The name of the metric.
+          value (float): The sampled value.
+        """
+        self.samples[name].append(value)
+
+    def percentile(self, name: str, pct: float) -> Optional[float]:
+        """
+        Gets a percentile of the recent samples of a metric.
+        Args:
+          name (str): The name of the metric.
+          pct (float): The percentile, from 0 to 100.
+        Returns:
+          float: The percentile, or None if nothing has been observed.
+        Examples:
+          >>> metrics.percentile("chat_latency", 99)
+          4.2
+        """
+        values = sorted(self.samples.get(name, ()))
+        if not values:
+            return None
+        index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+        return values[index]
+
+    def snapshot(self) -> dict:
+        """
+        Gets the current value of every metric.
+        Returns:
+          dict: Counters and gauges by name, and p50/p95/p99 of every observed metric.
+        """
+        snapshot = dict(self.counters)
+        snapshot.update(self.gauges)
+        for name in list(self.samples):
+            for pct in (50, 95, 99):
+                value = self.percentile(name, pct)
+                if value is not None:
+                    snapshot[f"{name}_p{pct}"] = round(value, 3)
+        return snapshot
+
+
+metrics = Metrics()
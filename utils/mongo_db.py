@@ -1,6 +1,38 @@
-from pymongo import MongoClient
+import functools
+import re
+from datetime import datetime, timedelta
+from typing import Optional
+import pymongo
+from pymongo import MongoClient, ReplaceOne
+from pymongo.errors import PyMongoError
 import os
 
+from utils.breaker import get_breaker
+
+
+def guarded(method):
+    """
+    Runs a MongoDBHandler method through the mongo circuit breaker, within its adaptive timeout.
+    Args:
+      method (Callable): The method to guard.
+    Returns:
+      Callable: The guarded method.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        breaker = get_breaker("mongo")
+
+        def call():
+            with pymongo.timeout(breaker.timeout()):
+                return method(self, *args, **kwargs)
+
+        return breaker.call_sync(call, errors=(PyMongoError,))
+
+    return wrapper
+
+
+handlers = []
 
 
 class MongoDBHandler:
@@ -16,9 +48,17 @@ class MongoDBHandler:
         """
         self.client = MongoClient(os.environ.get("MONGO_URI"))
         self.db = self.client[database_name]
+        handlers.append(self)
 
+    def close(self) -> None:
+        """
+        Closes the connections to MongoDB.
+        """
+        self.client.close()
+
+    @guarded
     def handle_data(
-        self, user_id, user_name, db_name, db_id, ingest_url, ingested_time
+        self, user_id, user_name, db_name, db_id, ingest_url, ingested_time, normalized_url=None
     ):
         """
         Handles data for a user.
@@ -29,6 +69,7 @@ class MongoDBHandler:
           db_id (str): The ID of the document.
           ingest_url (str): The URL of the document.
           ingested_time (str): The time the document was ingested.
+          normalized_url (str, optional): The normalized URL, that recent ingests are found by.
         Side Effects:
           Inserts or updates a user in the MongoDB database.
         """
@@ -48,8 +89,11 @@ class MongoDBHandler:
                 "ingested_time": ingested_time,
             }
         }
+        if normalized_url is not None:
+            data["db"]["normalized_url"] = normalized_url
         user_collection.update_one({"user_id": user_id}, {"$push": {"data": data}})
 
+    @guarded
     def list_db(self, user_id: str):
         """
         Lists all documents for a user.
@@ -82,6 +126,7 @@ class MongoDBHandler:
         else:
             return "User not found"
           
+    @guarded
     def list_all_db(self):
       """
       Lists all documents for all users.
@@ -109,6 +154,7 @@ class MongoDBHandler:
       else:
           return "No DB found"
 
+    @guarded
     def delete_db(self, user_id: str, db_id: str):
         """
         Deletes a document for a user.
@@ -133,6 +179,7 @@ class MongoDBHandler:
             return False
 
 
+    @guarded
     def get_db_name(self, user_id: str, db_id: str):
         """
         Gets the name of a document for a user.
@@ -161,6 +208,7 @@ class MongoDBHandler:
         else:
             raise ValueError("No user found with the provided db ID.")
 
+    @guarded
     def check_exists(self, db_id: str):
         """
         Checks if a db exists for any user.
@@ -176,3 +224,140 @@ class MongoDBHandler:
         user = user_collection.find_one({"data": { "$elemMatch": { "db.db_id": db_id } } })
 
         return user is not None
+
+    @guarded
+    def find_ingest(self, url: str, since: datetime):
+        """
+        Finds a db ingested from a URL since a given time.
+        Args:
+          url (str): The normalized URL.
+          since (datetime): The earliest ingest time to accept.
+        Returns:
+          str: The ID of the most recent matching db, or None if there is none.
+        Examples:
+          >>> find_ingest('https://gpt-engineer.readthedocs.io/en/latest', datetime(2023, 8, 1))
+          '456'
+        """
+        user_collection = self.db["users"]
+        latest = None
+        for user in user_collection.find({"data.db.normalized_url": url}):
+            for entry in user["data"]:
+                db = entry["db"]
+                if db.get("normalized_url") == url and db["ingested_time"] >= since:
+                    if latest is None or db["ingested_time"] > latest["ingested_time"]:
+                        latest = db
+
+        return latest["db_id"] if latest else None
+
+    @guarded
+    def save_history(self, user_id: str, db_id: str, turns: list, updated: float, ttl: float = 1800):
+        """
+        Saves an askdb conversation that was evicted from memory.
+        Args:
+          user_id (str): The ID of the user.
+          db_id (str): The ID of the db.
+          turns (list): The [question, answer, tokens] turns of the conversation.
+          updated (float): The time the conversation was last used.
+          ttl (float): Seconds after which the saved conversation is removed.
+        Side Effects:
+          Inserts or replaces the conversation in the history collection.
+        """
+        history_collection = self.db["history"]
+        if not getattr(self, "_history_indexed", False):
+            history_collection.create_index("expires_at", expireAfterSeconds=0)
+            self._history_indexed = True
+
+        history_collection.replace_one(
+            {"user_id": user_id, "db_id": db_id},
+            {
+                "user_id": user_id,
+                "db_id": db_id,
+                "turns": turns,
+                "updated": updated,
+                "expires_at": datetime.utcfromtimestamp(updated) + timedelta(seconds=ttl),
+            },
+            upsert=True,
+        )
+
+    @guarded
+    def pop_history(self, user_id: str, db_id: str):
+        """
+        Removes and returns a saved askdb conversation.
+        Args:
+          user_id (str): The ID of the user.
+          db_id (str): The ID of the db.
+        Returns:
+          dict: The saved conversation, or None if there is none.
+        Examples:
+          >>> pop_history('123', '456')
+          {'user_id': '123', 'db_id': '456', 'turns': [['What is GPT-Engineer?', 'GPT-Engineer is ...', 42]], 'updated': 1690000000.0, ...}
+        """
+        history_collection = self.db["history"]
+        return history_collection.find_one_and_delete({"user_id": user_id, "db_id": db_id})
+
+    @guarded
+    def delete_history(self, db_id: str, user_id: Optional[str] = None):
+        """
+        Deletes the saved askdb conversations about a db, alone or together with other dbs.
+        Args:
+          db_id (str): The ID of the db.
+          user_id (str, optional): Only delete this user's conversations. Defaults to every user's.
+        """
+        history_collection = self.db["history"]
+        query = {"db_id": {"$regex": re.escape(db_id)}}
+        if user_id is not None:
+            query["user_id"] = user_id
+        history_collection.delete_many(query)
+
+    @guarded
+    def load_chat(self, key: str):
+        """
+        Loads a saved chat conversation.
+        Args:
+          key (str): The "guild_id:channel_id" key of the conversation.
+        Returns:
+          bytes: The serialized conversation, or None if there is none.
+        Examples:
+          >>> load_chat('123:456')
+          b'x\x9c...'
+        """
+        chat_collection = self.db["chats"]
+        chat = chat_collection.find_one({"key": key}, {"memory": 1})
+        return bytes(chat["memory"]) if chat else None
+
+    @guarded
+    def save_chats(self, chats: dict, ttl: float = 604800):
+        """
+        Saves chat conversations in one batch.
+        Args:
+          chats (dict): The serialized conversations, by "guild_id:channel_id" key.
+          ttl (float): Seconds of inactivity after which a saved conversation is removed.
+        Side Effects:
+          Inserts or replaces the conversations in the chats collection.
+        """
+        chat_collection = self.db["chats"]
+        if not getattr(self, "_chats_indexed", False):
+            chat_collection.create_index("key", unique=True)
+            chat_collection.create_index("expires_at", expireAfterSeconds=0)
+            self._chats_indexed = True
+
+        expires_at = datetime.utcnow() + timedelta(seconds=ttl)
+        chat_collection.bulk_write(
+            [
+                ReplaceOne(
+                    {"key": key},
+                    {"key": key, "memory": memory, "expires_at": expires_at},
+                    upsert=True,
+                )
+                for key, memory in chats.items()
+            ],
+            ordered=False,
+        )
+
+
+def close_handlers() -> None:
+    """
+    Closes the connections of every MongoDBHandler.
+    """
+    for handler in handlers:
+        handler.close()
@@ -0,0 +1,138 @@
+import os
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from langchain.prompts.chat import (ChatPromptTemplate,
+                                    HumanMessagePromptTemplate,
+                                    MessagesPlaceholder,
+                                    SystemMessagePromptTemplate)
+
+from utils.context import count_tokens
+from utils.tools import label_pattern
+
+if TYPE_CHECKING:
+    from discord_bot.bot import Bot
+
+
+class CompiledPrompt:
+    """
+    A chat prompt built from a prompt file, with its token count.
+    """
+
+    def __init__(self, text: str, model: str = ""):
+        """
+        Initializes the CompiledPrompt class.
+        Args:
+          text (str): The system prompt, with the persona filled in.
+          model (str): The model the tokens are counted for.
+        """
+        self.text = text
+        self.tokens = count_tokens(text, model)
+        self.template = ChatPromptTemplate.from_messages(
+            [
+                SystemMessagePromptTemplate.from_template(text),
+                MessagesPlaceholder(variable_name="history"),
+                HumanMessagePromptTemplate.from_template("{input}"),
+            ]
+        )
+
+
+class PromptRegistry:
+    """
+    Compiles the prompt files of the configs directory once, recompiling them when they change.
+    """
+
+    def __init__(self, directory: Path, check_interval: float = 2):
+        """
+        Initializes the PromptRegistry class.
+        Args:
+          directory (Path): The directory of the prompt files.
+          check_interval (float): The most often, in seconds, a prompt file is checked for changes.
+        """
+        self.directory = Path(directory)
+        self.check_interval = check_interval
+        self.compiled = {}
+        self.mtimes = {}
+        self.checked = {}
+
+    def get(self, name: str, persona: str, model: str = "") -> CompiledPrompt:
+        """
+        Gets a compiled chat prompt.
+        Args:
+          name (str): The name of the prompt file, such as "preprompt".
+          persona (str): The persona that replaces {persona} in the file.
+          model (str): The model the tokens are counted for.
+        Returns:
+          CompiledPrompt: The prompt, compiled on first use and again after the file changes.
+        Examples:
+          >>> registry.get("preprompt", "Engi").tokens
+          212
+        """
+        self.check(name)
+        key = (name, persona, model)
+        prompt = self.compiled.get(key)
+        if prompt is None:
+            with open(self.directory / name, "r") as f:
+                text = f.read()
+            prompt = CompiledPrompt(text.replace("{persona}", persona), model)
+            self.compiled[key] = prompt
+        return prompt
+
+    def check(self, name: str) -> None:
+        """
+        Drops the compiled prompts of a file if it was modified since it was compiled.
+        Args:
+          name (str): The name of the prompt file.
+        """
+        now = time.monotonic()
+        if now - self.checked.get(name, float("-inf")) < self.check_interval:
+            return
+        self.checked[name] = now
+
+        mtime = os.stat(self.directory / name).st_mtime_ns
+        if self.mtimes.get(name) != mtime:
+            self.mtimes[name] = mtime
+            self.invalidate(name)
+
+    def invalidate(self, name: str = "") -> None:
+        """
+        Drops compiled prompts, so they are rebuilt on their next use.
+        Args:
+          name (str): The prompt file to drop, or every file when empty.
+        """
+        for key in [key for key in self.compiled if not name or key[0] == name]:
+            del self.compiled[key]
+
+
+_registries = {}
+
+
+def get_prompts(bot: "Bot") -> PromptRegistry:
+    """
+    Gets the prompt registry of the bot's configs directory.
+    Args:
+      bot (Bot): The bot instance.
+    Returns:
+      PromptRegistry: The shared registry.
+    """
+    directory = bot.paths["configs"]
+    if directory not in _registries:
+        _registries[directory] = PromptRegistry(
+            directory, check_interval=bot.config.get("prompt_check_interval", 2)
+        )
+    return _registries[directory]
+
+
+def set_persona(bot: "Bot", persona: str) -> None:
+    """
+    Changes the persona of the running bot.
+    Args:
+      bot (Bot): The bot instance.
+      persona (str): The new persona.
+    Side Effects:
+      Updates the bot's config, and drops the prompts and response labels compiled for the old persona.
+    """
+    bot.config["persona"] = persona
+    get_prompts(bot).invalidate()
+    label_pattern.cache_clear()
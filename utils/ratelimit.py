@@ -0,0 +1,241 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING
+
+from utils.metrics import metrics
+
+if TYPE_CHECKING:
+    from discord_bot.bot import Bot
+
+PRIORITIES = ("chat", "askdb", "ingest")
+
+
+class Reservation:
+    """
+    Request and token budget granted by a RateLimiter.
+    """
+
+    def __init__(self, limiter: "RateLimiter", tokens: int):
+        """
+        Initializes the Reservation class.
+        Args:
+          limiter (RateLimiter): The limiter that granted the budget.
+          tokens (int): The estimated tokens granted.
+        """
+        self.limiter = limiter
+        self.tokens = tokens
+        self.released = False
+        self.sent_tokens = None
+
+    def send(self, prompt_tokens: int) -> None:
+        """
+        Marks the call as sent, so the prompt is paid for even if the call is cancelled.
+        Args:
+          prompt_tokens (int): The estimated tokens of the prompt.
+        """
+        self.sent_tokens = min(self.tokens, prompt_tokens)
+
+    def settle(self, used_tokens: int) -> None:
+        """
+        Corrects the granted tokens to the number the API reported using.
+        Args:
+          used_tokens (int): The tokens actually used.
+        """
+        if self.released:
+            return
+        self.limiter.refund(0, self.tokens - used_tokens)
+        self.tokens = used_tokens
+
+    def release(self) -> None:
+        """
+        Gives the whole budget back, for a call that was cancelled before it used it.
+        """
+        if self.released:
+            return
+        self.released = True
+        self.limiter.refund(1, self.tokens)
+
+    def cancel(self) -> None:
+        """
+        Gives back the budget a cancelled call did not use.
+        Notes:
+          A call cancelled after it was sent keeps its request and prompt tokens, and only
+          the unused completion estimate is refunded. One never sent is refunded entirely.
+        """
+        if self.sent_tokens is None:
+            self.release()
+        else:
+            self.settle(self.sent_tokens)
+
+
+class RateLimiter:
+    """
+    Process-wide OpenAI request and token budget with priority classes.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = 3500,
+        tokens_per_minute: int = 90000,
+        background_reserve: float = 0.2,
+    ):
+        """
+        Initializes the RateLimiter class.
+        Args:
+          requests_per_minute (int): The requests allowed per minute.
+          tokens_per_minute (int): The tokens allowed per minute.
+          background_reserve (float): The share of each bucket that ingest work may not use.
+        Notes:
+          Waiting work is granted strictly by priority: chat, then askdb, then ingest.
+          Within a priority, guilds take turns.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.background_reserve = background_reserve
+        self.requests = float(requests_per_minute)
+        self.tokens = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self.queues = {priority: OrderedDict() for priority in PRIORITIES}
+        self.timer = None
+
+    async def acquire(self, priority: str, tokens: int, group: str = "") -> Reservation:
+        """
+        Waits until a request of the given size may be sent.
+        Args:
+          priority (str): One of "chat", "askdb" or "ingest".
+          tokens (int): The estimated tokens of the request, prompt and completion.
+          group (str): The guild the request is for, for fair queuing.
+        Returns:
+          Reservation: The granted budget.
+        Examples:
+          >>> reservation = await limiter.acquire("chat", 850, "123")
+        """
+        reserve = self.background_reserve if priority == "ingest" else 0
+        tokens = max(1, min(int(tokens), int(self.tokens_per_minute * (1 - reserve))))
+        future = asyncio.get_running_loop().create_future()
+        self.queues[priority].setdefault(group, deque()).append((tokens, future))
+        started = time.monotonic()
+        self.dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.refund(1, tokens)
+            raise
+
+        metrics.observe(f"ratelimit_wait_{priority}", time.monotonic() - started)
+        return Reservation(self, tokens)
+
+    @asynccontextmanager
+    async def limit(self, priority: str, tokens: int, group: str = ""):
+        """
+        Holds a reservation for the duration of a call, giving back what it did not use if the call is cancelled.
+        Args:
+          priority (str): One of "chat", "askdb" or "ingest".
+          tokens (int): The estimated tokens of the request.
+          group (str): The guild the request is for.
+        Yields:
+          Reservation: The granted budget, to mark as sent and settle with the actual usage.
+        Examples:
+          >>> async with limiter.limit("askdb", 1200, "123") as reservation:
+          ...     reservation.send(700)
+          ...     reservation.settle(1100)
+        """
+        reservation = await self.acquire(priority, tokens, group)
+        try:
+            yield reservation
+        except asyncio.CancelledError:
+            reservation.cancel()
+            raise
+
+    def refund(self, requests: int, tokens: float) -> None:
+        """
+        Returns budget to the buckets, or takes more when tokens is negative.
+        Args:
+          requests (int): The requests to give back.
+          tokens (float): The tokens to give back.
+        """
+        self.refill()
+        self.requests = min(self.requests_per_minute, self.requests + requests)
+        self.tokens = min(self.tokens_per_minute, self.tokens + tokens)
+        self.dispatch()
+
+    def refill(self) -> None:
+        """
+        Refills the buckets for the time passed since the last refill.
+        """
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        self.requests = min(
+            self.requests_per_minute, self.requests + elapsed * self.requests_per_minute / 60
+        )
+        self.tokens = min(
+            self.tokens_per_minute, self.tokens + elapsed * self.tokens_per_minute / 60
+        )
+
+    def dispatch(self) -> None:
+        """
+        Grants waiting requests in priority order while the buckets allow.
+        Side Effects:
+          Schedules another dispatch for when the first waiting request will fit.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.refill()
+        metrics.set("ratelimit_tokens_available", int(self.tokens))
+
+        for priority in PRIORITIES:
+            queue = self.queues[priority]
+            reserve = self.background_reserve if priority == "ingest" else 0
+
+            while queue:
+                group, waiters = next(iter(queue.items()))
+                while waiters and waiters[0][1].done():
+                    waiters.popleft()
+                if not waiters:
+                    del queue[group]
+                    continue
+
+                tokens, future = waiters[0]
+                needed_requests = 1 + reserve * self.requests_per_minute - self.requests
+                needed_tokens = tokens + reserve * self.tokens_per_minute - self.tokens
+                if needed_requests > 0 or needed_tokens > 0:
+                    delay = max(
+                        needed_requests * 60 / self.requests_per_minute,
+                        needed_tokens * 60 / self.tokens_per_minute,
+                    )
+                    self.timer = asyncio.get_running_loop().call_later(delay, self.dispatch)
+                    return
+
+                waiters.popleft()
+                self.requests -= 1
+                self.tokens -= tokens
+                future.set_result(None)
+                queue.move_to_end(group)
+                if not waiters:
+                    del queue[group]
+
+
+_limiters = {}
+
+
+def get_limiter(bot: "Bot") -> RateLimiter:
+    """
+    Gets the rate limiter shared by everything using the bot's OpenAI key.
+    Args:
+      bot (Bot): The bot instance.
+    Returns:
+      RateLimiter: The shared limiter.
+    """
+    if bot.openai_api_key not in _limiters:
+        _limiters[bot.openai_api_key] = RateLimiter(
+            requests_per_minute=bot.config.get("openai_requests_per_minute", 3500),
+            tokens_per_minute=bot.config.get("openai_tokens_per_minute", 90000),
+            background_reserve=bot.config.get("openai_background_reserve", 0.2),
+        )
+    return _limiters[bot.openai_api_key]
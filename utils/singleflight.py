@@ -0,0 +1,67 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+from utils.metrics import metrics
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time, sharing its result with concurrent duplicates.
+    """
+
+    def __init__(self, name: str = "singleflight"):
+        """
+        Initializes the SingleFlight class.
+        Args:
+          name (str): The prefix of the metrics recorded for shared calls.
+        """
+        self.name = name
+        self.calls = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Runs a call, or waits for the identical call already in flight.
+        Args:
+          key (Hashable): Identifies duplicate calls.
+          func (Callable): Starts the call when no duplicate is in flight.
+        Returns:
+          Any: The result of the call.
+        Raises:
+          Exception: Whatever the call raised, re-raised to every caller waiting on it.
+        Notes:
+          A caller that is cancelled stops waiting without cancelling the call for the others.
+          The call itself is cancelled once every caller waiting on it has been cancelled.
+        Examples:
+          >>> await flight.do(("456", "what is gpt-engineer?"), lambda: chat_query.ask(query, []))
+          {"question": "What is GPT-Engineer?", "answer": "...", "source_documents": [...]}
+        """
+        call = self.calls.get(key)
+        if call is None:
+            call = {"task": asyncio.create_task(func()), "waiters": 0}
+            self.calls[key] = call
+            call["task"].add_done_callback(lambda _: self._forget(key, call))
+        else:
+            metrics.incr(f"{self.name}_shared")
+
+        call["waiters"] += 1
+        try:
+            return await asyncio.shield(call["task"])
+        except asyncio.CancelledError:
+            if call["waiters"] == 1 and not call["task"].done():
+                call["task"].cancel()
+            raise
+        finally:
+            call["waiters"] -= 1
+
+    def _forget(self, key: Hashable, call: dict) -> None:
+        """
+        Removes a finished call so the next request for its key starts afresh.
+        Args:
+          key (Hashable): The key of the call.
+          call (dict): The finished call.
+        """
+        if self.calls.get(key) is call:
+            del self.calls[key]
+        task = call["task"]
+        if not task.cancelled():
+            task.exception()
@@ -1,6 +1,7 @@
 import json
 import re
 import traceback
+from functools import lru_cache
 from typing import TYPE_CHECKING
 
 import discord
@@ -215,6 +216,37 @@ def make_filepaths(paths: dict):
             path.mkdir(parents=True, exist_ok=True)
             
 
+def response_labels(persona: str, actor: str, user: str) -> list:
+    """
+    Gets the labels a response may be prefixed with.
+    Args:
+      persona (str): The bot's persona.
+      actor (str): The bot's actor.
+      user (str): The user's name.
+    Returns:
+      list: The labels, longest first.
+    """
+    labels = {"System: ", "User: ", "Assistant: ", "[System]: ", "[User]: ", "[Assistant]: "}
+    labels.update({f"{persona}: ", f"[{actor}]: ", f"{user}: ", f"[{user}]: "})
+    return sorted(labels, key=len, reverse=True)
+
+
+@lru_cache(maxsize=256)
+def label_pattern(persona: str, actor: str, user: str) -> "re.Pattern":
+    """
+    Compiles the labels a response may be prefixed with into one pattern.
+    Args:
+      persona (str): The bot's persona.
+      actor (str): The bot's actor.
+      user (str): The user's name.
+    Returns:
+      re.Pattern: A pattern matching any of the labels, longest first.
+    Notes:
+      Patterns are cached per (persona, actor, user). set_persona clears the cache.
+    """
+    return re.compile("|".join(re.escape(label) for label in response_labels(persona, actor, user)))
+
+
 def clean_response(bot: 'Bot', user: str, response: str):
     """
     Removes labels from a response string.
@@ -228,104 +260,225 @@ def clean_response(bot: 'Bot', user: str, response: str):
       >>> clean_response(bot, "User", "User: Hello")
       "Hello"
     """
-    labels = [
-        "System: ",
-        "User: ",
-        "Assistant: ",
-        "[System]: ",
-        "[User]: ",
-        "[Assistant]: ",
-        f"{bot.config.get('persona')}: ",
-        f"[{bot.config.get('actor')}]: ",
-        f"{user}: ",
-        f"[{user}]: ",
-    ]
+    config = bot.config
+    return label_pattern(config.get("persona"), config.get("actor"), user).sub("", response)
 
-    for label in labels:
-        response = response.replace(label, "")
 
-    return response
+class LabelStripper:
+    """
+    Removes labels from a response as it is streamed.
+    """
 
+    def __init__(self, bot: "Bot", user: str):
+        """
+        Initializes the LabelStripper class.
+        Args:
+          bot (Bot): The Bot instance.
+          user (str): The user's name.
+        """
+        persona = bot.config.get("persona")
+        actor = bot.config.get("actor")
+        self.pattern = label_pattern(persona, actor, user)
+        self.hold = len(response_labels(persona, actor, user)[0]) - 1
+        self.held = ""
 
-def split_chat(chat, max_chars=2000):
+    def feed(self, text: str) -> str:
+        """
+        Cleans the next fragment of the response.
+        Args:
+          text (str): The fragment, such as a streamed token.
+        Returns:
+          str: The cleaned text that can no longer be part of a label. The rest is held back.
+        Examples:
+          >>> stripper = LabelStripper(bot, "User")
+          >>> stripper.feed("Us") + stripper.feed("er: Hello there, how are you?") + stripper.close()
+          "Hello there, how are you?"
+        """
+        text = self.held + text
+        safe = len(text) - self.hold
+        parts = []
+        pos = 0
+        for match in self.pattern.finditer(text):
+            if match.start() >= safe:
+                break
+            parts.append(text[pos:match.start()])
+            pos = match.end()
+        end = max(pos, safe)
+        parts.append(text[pos:end])
+        self.held = text[end:]
+        return "".join(parts)
+
+    def close(self) -> str:
+        """
+        Ends the response.
+        Returns:
+          str: The cleaned text held back.
+        """
+        text, self.held = self.held, ""
+        return self.pattern.sub("", text)
+
+
+class ChatSplitter:
     """
-    Splits a chat into chunks of a maximum length.
-    Args:
-      chat (str): The chat string.
-      max_chars (int, optional): The maximum length of each chunk. Defaults to 2000.
-    Returns:
-      list: A list of chunks.
-    Examples:
-      >>> split_chat("Hello world!", 5)
-      ["Hello", " worl", "d!"]
+    Splits text into Discord sized chunks as it arrives, keeping code blocks intact across chunks.
     """
-    lines = chat.split("\n")
-    chunks = []
-    chunk = ""
-    inside_code_block = False
-    language = ""
 
-    code_block_start_pattern = re.compile(r"^```[\s]*\w*")
-    code_block_end_pattern = re.compile(r"^```$")
+    FENCE = re.compile(r"^```\s*\w*")
+    CLOSE_FENCE = "```\n"
 
-    def add_chunk(chunk):
+    def __init__(self, max_chars: int = 2000):
         """
-        Adds a chunk to a list of chunks.
+        Initializes the ChatSplitter class.
         Args:
-          chunk (str): The chunk to add.
-          chunks (list): The list of chunks.
+          max_chars (int, optional): The maximum length of each chunk. Defaults to 2000.
+        """
+        self.max_chars = max_chars
+        self.ready = []
+        self.parts = []
+        self.size = 0
+        self.line = []
+        self.fed = False
+        self.inside_code_block = False
+        self.language = ""
+
+    def feed(self, text: str) -> list:
+        """
+        Adds text to the chat.
+        Args:
+          text (str): The next fragment of the chat, such as a streamed token.
         Returns:
-          None
-        Side Effects:
-          Adds the chunk to the list of chunks.
+          list: The chunks completed by the fragment, possibly none.
         Examples:
-          >>> chunks = []
-          >>> add_chunk("Hello", chunks)
-          >>> chunks
-          ["Hello"]
+          >>> splitter = ChatSplitter()
+          >>> splitter.feed("Hello ")
+          []
         """
-        if chunk:
-            chunks.append(chunk)
-
-    for line in lines:
-        if code_block_start_pattern.match(line):
-            if not inside_code_block and chunk:
-                add_chunk(chunk)
-                chunk = ""
-            inside_code_block = True
-            language = line.strip("`").strip()
-
-            if len(chunk) + len(line) + 1 > max_chars:
-                add_chunk(chunk)
-                chunk = ""
-            chunk += line + "\n"
-            continue
-
-        elif code_block_end_pattern.match(line):
-            inside_code_block = False
-
-            if len(chunk) + len(line) + 1 > max_chars:
-                add_chunk(chunk)
-                chunk = ""
-            chunk += line + "\n"
-            add_chunk(chunk)
-            chunk = ""
-            continue
-
-        if inside_code_block:
-            if len(chunk) + len(line) + 1 > max_chars:
-                chunk += "```\n"
-                add_chunk(chunk)
-                chunk = ""
-
-                chunk += f"```{language}\n"
-            chunk += line + "\n"
-        else:
-            if len(chunk) + len(line) + 1 > max_chars:
-                add_chunk(chunk)
-                chunk = ""
-            chunk += line + "\n"
+        if text:
+            self.fed = True
+            lines = text.split("\n")
+            if len(lines) > 1:
+                self.line.append(lines[0])
+                self.add_line("".join(self.line))
+                for line in lines[1:-1]:
+                    self.add_line(line)
+                self.line = []
+            if lines[-1]:
+                self.line.append(lines[-1])
+        return self.take()
+
+    def close(self) -> list:
+        """
+        Ends the chat.
+        Returns:
+          list: The remaining chunks.
+        """
+        if self.fed:
+            self.add_line("".join(self.line))
+            self.line = []
+            self.fed = False
+        self.flush()
+        return self.take()
+
+    def take(self) -> list:
+        """
+        Hands over the completed chunks.
+        Returns:
+          list: The chunks completed since the last call.
+        """
+        ready, self.ready = self.ready, []
+        return ready
 
-    add_chunk(chunk)
+    def add_line(self, line: str) -> None:
+        """
+        Adds a complete line, starting a new chunk when it does not fit.
+        Args:
+          line (str): The line, without its newline.
+        Notes:
+          A code block starts a new chunk, and ends its chunk. A code block split across chunks is
+          closed at the end of one chunk and reopened, with its language, at the start of the next.
+        """
+        needed = len(line) + 1
+        if not line.startswith("```"):
+            if self.size + needed > self.limit():
+                self.split()
+            self.append(line)
+        elif self.FENCE.match(line) and not (self.inside_code_block and line.strip() == "```"):
+            if not self.inside_code_block:
+                self.flush()
+            self.inside_code_block = True
+            self.language = line.strip("`").strip()
+            if self.size + needed > self.max_chars:
+                self.flush()
+            self.append(line)
+        elif self.inside_code_block and line.strip() == "```":
+            self.inside_code_block = False
+            if self.size + needed > self.max_chars:
+                self.flush()
+            self.append(line)
+            self.flush()
+
+    def append(self, line: str) -> None:
+        """
+        Adds a line to the current chunk, cutting it where it is longer than a whole chunk.
+        Args:
+          line (str): The line, without its newline.
+        """
+        text = line + "\n"
+        if self.size + len(text) <= self.max_chars - len(self.CLOSE_FENCE):
+            self.parts.append(text)
+            self.size += len(text)
+            return
+        while self.size + len(text) > self.limit():
+            cut = self.limit() - self.size
+            self.parts.append(text[:cut])
+            self.size += cut
+            text = text[cut:]
+            self.split()
+        self.parts.append(text)
+        self.size += len(text)
+
+    def limit(self) -> int:
+        """
+        Gets the room in a chunk.
+        Returns:
+          int: max_chars, less the closing fence inside a code block.
+        """
+        return self.max_chars - len(self.CLOSE_FENCE) if self.inside_code_block else self.max_chars
 
-    return chunks
\ No newline at end of file
+    def split(self) -> None:
+        """
+        Ends the current chunk, closing and reopening the code block if inside one.
+        """
+        if not self.inside_code_block:
+            self.flush()
+            return
+        self.parts.append(self.CLOSE_FENCE)
+        self.flush()
+        reopen = f"```{self.language}\n"
+        self.parts.append(reopen)
+        self.size = len(reopen)
+
+    def flush(self) -> None:
+        """
+        Ends the current chunk, if it is not empty.
+        """
+        if self.parts:
+            self.ready.append("".join(self.parts))
+        self.parts = []
+        self.size = 0
+
+
+def split_chat(chat, max_chars=2000):
+    """
+    Splits a chat into chunks of a maximum length.
+    Args:
+      chat (str): The chat string.
+      max_chars (int, optional): The maximum length of each chunk. Defaults to 2000.
+    Returns:
+      list: A list of chunks.
+    Examples:
+      >>> split_chat("Hello world!", 5)
+      ["Hello", " worl", "d!\\n"]
+    """
+    splitter = ChatSplitter(max_chars)
+    return splitter.feed(chat) + splitter.close()
@@ -0,0 +1,122 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from utils.metrics import metrics
+
+
+class WorkQueues:
+    """
+    Bounded per-key work queues, worked one item at a time per key, under a global concurrency cap.
+    """
+
+    def __init__(
+        self,
+        name: str = "work",
+        max_depth: int = 5,
+        max_concurrency: int = 8,
+        max_pending: int = 50,
+    ):
+        """
+        Initializes the WorkQueues class.
+        Args:
+          name (str): The prefix of the metrics recorded for the queues.
+          max_depth (int): The most items waiting in one key's queue.
+          max_concurrency (int): The most items being worked at once across all keys.
+          max_pending (int): The most items waiting across all keys.
+        """
+        self.name = name
+        self.max_depth = max_depth
+        self.max_pending = max_pending
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.queues = {}
+        self.workers = {}
+        self.pending = 0
+
+    def submit(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Optional[asyncio.Future]:
+        """
+        Queues work behind the other work of its key.
+        Args:
+          key (Hashable): The key whose queue the work joins, such as a channel ID.
+          func (Callable): Starts the work when its turn comes.
+        Returns:
+          asyncio.Future: Resolves to the result of the work, or None if the work was shed because the queues are full.
+        Notes:
+          Cancelling the returned future cancels the work, whether it is waiting or running.
+        Examples:
+          >>> future = queues.submit(channel.id, lambda: self.respond(message))
+          >>> if future is None:
+          ...     await channel.send("I'm busy right now, please try again in a moment.")
+        """
+        queue = self.queues.get(key)
+        depth = len(queue) if queue is not None else 0
+        if depth >= self.max_depth or self.pending >= self.max_pending:
+            metrics.incr(f"{self.name}_shed")
+            return None
+
+        if queue is None:
+            queue = self.queues[key] = deque()
+        future = asyncio.get_running_loop().create_future()
+        queue.append((func, future, time.monotonic()))
+        self.pending += 1
+        metrics.set(f"{self.name}_queue_depth", self.pending)
+
+        if key not in self.workers:
+            self.workers[key] = asyncio.create_task(self._work(key))
+        return future
+
+    async def _work(self, key: Hashable) -> None:
+        """
+        Works through a key's queue in order, then exits.
+        Args:
+          key (Hashable): The key of the queue.
+        """
+        queue = self.queues[key]
+        try:
+            while queue:
+                func, future, queued = queue[0]
+                if future.done():
+                    self._pop(queue)
+                    continue
+
+                async with self.semaphore:
+                    self._pop(queue)
+                    if future.done():
+                        continue
+                    metrics.observe(f"{self.name}_queue_wait", time.monotonic() - queued)
+                    await self._run(func, future)
+        finally:
+            del self.workers[key]
+            if not queue:
+                del self.queues[key]
+
+    async def _run(self, func: Callable[[], Awaitable[Any]], future: asyncio.Future) -> None:
+        """
+        Runs one item of work, passing its outcome to its future.
+        Args:
+          func (Callable): Starts the work.
+          future (asyncio.Future): The future of the work.
+        """
+        task = asyncio.create_task(func())
+        future.add_done_callback(lambda _: task.cancel() if future.cancelled() else None)
+        await asyncio.wait([task])
+
+        if future.done():
+            return
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    def _pop(self, queue: deque) -> None:
+        """
+        Removes the first item of a queue.
+        Args:
+          queue (deque): The queue.
+        """
+        queue.popleft()
+        self.pending -= 1
+        metrics.set(f"{self.name}_queue_depth", self.pending)